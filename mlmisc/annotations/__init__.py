@@ -1,6 +1,8 @@
 import os
 import glob
 import importlib
+import collections
+import concurrent.futures
 
 
 def modules():
@@ -17,3 +19,22 @@ def modules():
         for name in names
     }
     return modules
+
+
+def prefetch(items, load, depth=16, workers=4):
+    """
+    yield load(item) for each item in order, up to depth items are loaded
+    ahead by a pool of workers threads, cv2 releases the GIL while reading
+    """
+    if depth <= 0 or workers <= 0:
+        for item in items:
+            yield load(item)
+        return
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append(executor.submit(load, item))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
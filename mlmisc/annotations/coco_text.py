@@ -1,12 +1,34 @@
-from mltools.thirdparty.coco_text.coco_text import COCO_Text
+from mlmisc.thirdparty.coco_text.coco_text import COCO_Text
 import os
 import cv2
 import logging
-from mltools.dataset.datasettools import fromlabels
+import numpy
+from mlmisc.dataset.annotation import (read_image, fromlabels, Annotation,
+                                       StringTable, pack_strings)
+from mlmisc.annotations import prefetch
 
 
-def annotations(annofile, imagedir=None, labels=None):
+def annotations(annofile,
+                imagedir=None,
+                labels=None,
+                decode_image=False,
+                prefetch_depth=16,
+                prefetch_workers=4,
+                order=None,
+                cache_dir=None,
+                invalidate_cache=False,
+                stream=False):
     """
+    the annotations are yielded as mlmisc.dataset.annotation.Annotation,
+    images are yielded encoded as they are stored in imagedir,
+    decode_image=True yields the decoded cv2 image array instead.
+    the images are read ahead by prefetch(), prefetch_depth=0 disables it.
+    order: None for the order of the annotation file, "split" to group the
+        images by train, val and test, "filename" to sort them by file
+    cache_dir: cache the parsed annotation file in cache_dir, see COCO_Text
+    stream: yield the images while the annotation file is parsed, see
+        COCO_Text.streamImages, neither order nor cache_dir are supported
+
     image["annotation"]["language"] in ("not english", "na", "english")
     image["annotation"]["legibility"] in ("legible", "illegible")
     image["annotation"]["class"] in
@@ -17,70 +39,81 @@ def annotations(annofile, imagedir=None, labels=None):
             logging.warn("only the first annofile({}) will be used".format(
                 annofile[0]))
         annofile = annofile[0]
-    coco = COCO_Text(annofile)
     if imagedir is not None:
         imagedir = os.path.expanduser(os.path.expandvars(imagedir))
-    image_map = {}
-    for annId in coco.getAnnIds():
-        ann = coco.loadAnns(ids=[annId])[0]
-        image_id = ann["image_id"]
-        if image_id not in image_map:
-            annotation = {
-                "xmin": [],
-                "ymin": [],
-                "xmax": [],
-                "ymax": [],
-                "class/text": [],
-                "class/label": [],
-                "area": [],
-                "difficulty": [],
-                "language": [],
-                "text": [],
-            }
-            image_map[image_id] = annotation
-        else:
-            annotation = image_map[image_id]
 
-        (x, y, width, height) = tuple(ann["bbox"])
-        if width <= 0 or height <= 0:
-            continue
-        annotation["xmin"].append(x)
-        annotation["ymin"].append(y)
-        annotation["xmax"].append(x + width)
-        annotation["ymax"].append(y + height)
-        annotation["language"].append(ann["language"])
-        annotation["class/text"].append(ann["class"])
-        if labels is not None:
-            label = fromlabels(ann["class"], labels, update=True)
-            annotation["class/label"].append(label)
+    if stream:
+        if order is not None:
+            raise ValueError("order is not supported when streaming")
+        if cache_dir is not None or invalidate_cache:
+            raise ValueError("cache_dir is not supported when streaming")
+        images = COCO_Text().streamImages(annofile, release=True)
+    else:
+        coco = COCO_Text(
+            annofile, cache_dir=cache_dir, invalidate_cache=invalidate_cache)
+        if order is None:
+            image_ids = list(coco.imgToAnns)
+        elif order == "split":
+            # the images without annotations have no imgToAnns entry
+            image_ids = [
+                image_id for image_id in coco.train + coco.val + coco.test
+                if image_id in coco.imgToAnns
+            ]
+        elif order == "filename":
+            image_ids = sorted(
+                coco.imgToAnns, key=lambda image_id: coco.imgs[image_id][
+                    "file_name"])
         else:
-            annotation["class/label"].append(None)
-        annotation["area"].append(ann["area"])
-        annotation["difficulty"].append(1 if ann["legibility"] == "illegible"
-                                        else 0)
-        annotation["text"].append(ann["utf8_string"]
-                                  if "utf8_string" in ann else "")
-    for image_id in image_map:
-        if len(image_map[image_id]) <= 0:
-            continue
-        image_anno = coco.loadImgs(ids=[image_id])[0]
+            raise ValueError("unexcepted order '{}'".format(order))
+        images = ((coco.imgs[image_id],
+                   [coco.anns[ann_id] for ann_id in coco.imgToAnns[image_id]])
+                  for image_id in image_ids)
+
+    def load(item):
+        image_anno, anns = item
+        image = {"image": None}
         if imagedir is not None and image_anno["file_name"]:
-            image = cv2.imread(
-                os.path.join(imagedir, image_anno["file_name"]))
-        else:
-            image = None
-        annotation = image_map[image_id]
-        yield {
-            "image": image,
-            "image/filename": image_anno["file_name"],
-            "image/object/bbox/xmin": annotation["xmin"],
-            "image/object/bbox/ymin": annotation["ymin"],
-            "image/object/bbox/xmax": annotation["xmax"],
-            "image/object/bbox/ymax": annotation["ymax"],
-            "image/object/class/text": annotation["class/text"],
-            "image/object/class/label": annotation["class/label"],
-            "image/object/area": annotation["area"],
-            "image/object/difficulty": annotation["difficulty"],
-            "image/object/language": annotation["language"],
-            "image/object/text": annotation["text"],
-        }
+            filename = os.path.join(imagedir, image_anno["file_name"])
+            if decode_image:
+                image["image"] = cv2.imread(filename)
+            else:
+                image = read_image(filename)
+        return image_anno, anns, image
+
+    table = StringTable()
+    for image_anno, anns, image in prefetch(
+            (item for item in images if item[1]),
+            load,
+            depth=prefetch_depth,
+            workers=prefetch_workers):
+        bbox = numpy.array([ann["bbox"] for ann in anns],
+                           dtype=numpy.float64).reshape([-1, 4])
+        valid = (bbox[:, 2] > 0) & (bbox[:, 3] > 0)
+        anns = [ann for ann, keep in zip(anns, valid.tolist()) if keep]
+        bbox = bbox[valid]
+        bbox[:, 2:] += bbox[:, :2]
+        classes = [ann["class"] for ann in anns]
+        texts, text_offsets = pack_strings(
+            [ann.get("utf8_string", "") for ann in anns])
+        yield Annotation(
+            table=table,
+            image=image.get("image"),
+            encoded=image.get("image/encoded"),
+            format=image.get("image/format"),
+            height=image_anno.get("height"),
+            width=image_anno.get("width"),
+            filename=image_anno["file_name"],
+            bbox=bbox.T.astype(numpy.float32),
+            area=numpy.array([ann["area"] for ann in anns],
+                             dtype=numpy.float32),
+            difficulty=numpy.array(
+                [ann["legibility"] == "illegible" for ann in anns],
+                dtype=numpy.uint8),
+            labels=None if labels is None else numpy.array(
+                [fromlabels(name, labels, update=True) for name in classes],
+                dtype=numpy.int32),
+            classes=table.encode(classes),
+            languages=table.encode([ann["language"] for ann in anns]),
+            texts=texts,
+            text_offsets=text_offsets,
+        )
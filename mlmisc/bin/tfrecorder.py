@@ -1,6 +1,12 @@
 from mlmisc import annotations
+from mlmisc.dataset import annotation as annotationtools
+from mlmisc.dataset import tfrecorder, recordio, protobuf
 import pyconfigmanager as configmanager
 import argparse
+import concurrent.futures
+import functools
+import logging
+import os
 SCHEMA = {
     "command": "",
     "convert": {
@@ -17,12 +23,32 @@ SCHEMA = {
         "image": {
             "dir": "",
         },
+        # duplicates the records at conversion time, prefer
+        # tfrecorder.dataset(rollover_probability=...) at read time
         "rollover": False,
+        "workers": 0,
+        "cache": {
+            "dir": "",
+            "invalidate": False,
+        },
+        "stream": False,
+        # "", "split" or "filename"
+        "order": "",
+        "prefetch": {
+            "depth": 16,
+            "workers": 4,
+        },
         "tfrecord": {
             "dir":
             "tfrecord",
             "batch_size":
             1000,
+            "compression_type":
+            "GZIP",
+            "index":
+            False,
+            "block_size":
+            0,
             "ratio": [0.99, 0.01, 0],
             "nameformats": [
                 "{:0>8d}-trainset.tfrecord",
@@ -33,6 +59,7 @@ SCHEMA = {
     },
     "inspect": {
         "filenames": [],
+        "compression_type": "GZIP",
         "image": {
             "dir": "images"
         },
@@ -43,6 +70,175 @@ SCHEMA = {
 }
 
 
+def readlabels(filename):
+    if not filename:
+        return None
+    with open(filename) as labelfile:
+        return [line.strip() for line in labelfile if line.strip()]
+
+
+def splits(items, ratio):
+    """
+    assign the items to the splits in proportion to ratio, deterministically
+    """
+    total = sum(ratio)
+    counts = [0] * len(ratio)
+    for count, item in enumerate(items, 1):
+        index = max(
+            range(len(ratio)),
+            key=lambda index: ratio[index] * count / total - counts[index])
+        counts[index] += 1
+        yield index, item
+
+
+INDEX_FIELDS = ("image/filename", "image/class/text", "image/class/label")
+
+
+def load_image(item, imagedir):
+    """
+    read the encoded image of the item from imagedir
+    """
+    if not imagedir or not item.get("image/filename"):
+        return item
+    image = annotationtools.read_image(
+        os.path.join(imagedir, item["image/filename"]))
+    if isinstance(item, annotationtools.Annotation):
+        item.encoded = image["image/encoded"]
+        item.format = image["image/format"]
+        return item
+    return dict(item, **image)
+
+
+def write_shard(filename,
+                items,
+                rollover=False,
+                options=None,
+                imagedir=None,
+                prefetch=None):
+    """
+    the images of the items are read from imagedir here, in the worker
+    process, prefetch: the keyword arguments of annotations.prefetch()
+    """
+    options = options or {}
+    load = functools.partial(load_image, imagedir=imagedir)
+    items = annotations.prefetch(items, load, **(prefetch or {}))
+    if rollover:
+        items = (item for original in items
+                 for item in (original, annotationtools.rollover(original)))
+    count = 0
+    with tfrecorder.writer(filename, **options) as writer:
+        # each record is encoded and written while the next images are read
+        for item in items:
+            writer.write(
+                tfrecorder.example(item).SerializeToString(), {
+                    name: item[name]
+                    for name in INDEX_FIELDS if item.get(name) is not None
+                })
+            count += 1
+    return filename, count
+
+
+def convert(config):
+    """
+    stream the annotations into a process pool, each task reads the images
+    and writes one shard of tfrecord.batch_size records
+    """
+    module = annotations.modules()[config.annotype]
+    labels = readlabels(config.label)
+    imagedir = config.image.dir
+    if imagedir:
+        imagedir = os.path.expanduser(os.path.expandvars(imagedir))
+    # only the image filenames are sent to the workers
+    items = module.annotations(
+        config.annofile,
+        imagedir=None,
+        labels=labels,
+        prefetch_depth=0,
+        order=config.order or None,
+        cache_dir=config.cache.dir or None,
+        invalidate_cache=config.cache.invalidate,
+        stream=config.stream,
+    )
+    outputdir = os.path.expanduser(os.path.expandvars(config.tfrecord.dir))
+    if not os.path.exists(outputdir):
+        os.makedirs(outputdir)
+    nameformats = config.tfrecord.nameformats
+    batches = [[] for _ in nameformats]
+    shards = [0 for _ in nameformats]
+    workers = config.workers or os.cpu_count()
+    pending = set()
+    options = {
+        "compression_type": config.tfrecord.compression_type,
+        "index": config.tfrecord.index,
+        "block_size": config.tfrecord.block_size or None,
+    }
+
+    def submit(executor, index):
+        filename = os.path.join(outputdir,
+                                nameformats[index].format(shards[index]))
+        pending.add(
+            executor.submit(write_shard, filename, batches[index],
+                            config.rollover, options, imagedir, {
+                                "depth": config.prefetch.depth,
+                                "workers": config.prefetch.workers,
+                            }))
+        batches[index] = []
+        shards[index] += 1
+
+    def drain(return_when):
+        done, _ = concurrent.futures.wait(pending, return_when=return_when)
+        for future in done:
+            pending.remove(future)
+            filename, count = future.result()
+            logging.info("{}: {} records".format(filename, count))
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for index, item in splits(items, config.tfrecord.ratio):
+            batches[index].append(item)
+            if len(batches[index]) >= config.tfrecord.batch_size:
+                submit(executor, index)
+                # bound the annotations held in memory by the queued shards
+                if len(pending) >= workers * 2:
+                    drain(concurrent.futures.FIRST_COMPLETED)
+        for index, batch in enumerate(batches):
+            if batch:
+                submit(executor, index)
+        drain(concurrent.futures.ALL_COMPLETED)
+    if labels is not None:
+        logging.info("labels: {}".format(labels))
+
+
+def inspect(config):
+    """
+    print the records of the tfrecord files, the images are saved to
+    image.dir if it is set
+    """
+    imagedir = config.image.dir
+    if imagedir:
+        imagedir = os.path.expanduser(os.path.expandvars(imagedir))
+        if not os.path.exists(imagedir):
+            os.makedirs(imagedir)
+    for filename in config.filenames:
+        with recordio.RecordReader(
+                filename, compression_type=config.compression_type) as reader:
+            for index, record in enumerate(reader):
+                feature = protobuf.decode_example(record)
+                print("{}[{}]:".format(filename, index))
+                for name, value in sorted(feature.items()):
+                    if name in ("image", "image/encoded"):
+                        print("  {}: {} bytes".format(name, len(value)))
+                    else:
+                        print("  {}: {}".format(name, value))
+                if imagedir and feature.get("image/encoded"):
+                    imagefile = os.path.join(
+                        imagedir, "{}-{:0>8d}.{}".format(
+                            os.path.basename(filename), index,
+                            feature.get("image/format", b"").decode()
+                            or "png"))
+                    with open(imagefile, "wb") as image:
+                        image.write(feature["image/encoded"])
+
+
 def main():
     config = configmanager.getconfig(schema=[
         SCHEMA, {
@@ -62,7 +258,12 @@ def main():
         config.dump_config(
             filename=config.config.dump, config_name="config.dump", exit=True)
     configmanager.logging.config(level=config.logging.verbosity)
-    print(config)
+    if config.command == "convert":
+        convert(config.convert)
+    elif config.command == "inspect":
+        inspect(config.inspect)
+    else:
+        print(config)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,19 @@
+import os
+import collections.abc
+import numpy
+
 METADATA = {
     "image": {
-        "type": "int64",
-        "shape": None,
+        "type": "string",
+        "shape": [],
+    },
+    "image/encoded": {
+        "type": "string",
+        "shape": [],
+    },
+    "image/format": {
+        "type": "string",
+        "shape": [],
     },
     "image/height": {
         "type": "int64",
@@ -81,39 +93,353 @@ METADATA = {
     },
 }
 
+IMAGE_FORMATS = {
+    ".jpg": "jpeg",
+    ".jpeg": "jpeg",
+    ".png": "png",
+    ".bmp": "bmp",
+    ".gif": "gif",
+}
 
-def rollover(annotation):
-    annotation = {
-        key: value
-        for key, value in annotation.items() if value is not None
+
+def image_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return IMAGE_FORMATS.get(extension, extension[1:])
+
+
+def read_image(filename):
+    """
+    read the encoded image file as it is, without a decode/encode round trip
+    """
+    with open(filename, "rb") as image_file:
+        encoded = image_file.read()
+    return {"image/encoded": encoded, "image/format": image_format(filename)}
+
+
+def fromlabels(name, labels, update=False):
+    """
+    the index of name in labels, name is appended to labels if update
+    """
+    if name not in labels:
+        if not update:
+            return None
+        labels.append(name)
+    return labels.index(name)
+
+
+BBOX_KEYS = ("image/object/bbox/xmin", "image/object/bbox/ymin",
+             "image/object/bbox/xmax", "image/object/bbox/ymax")
+
+
+class StringTable:
+    """
+    interned strings, the records refer to them by int32 codes
+    """
+    __slots__ = ("strings", "codes")
+
+    def __init__(self, strings=()):
+        self.strings = []
+        self.codes = {}
+        for string in strings:
+            self.code(string)
+
+    def code(self, string):
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def encode(self, strings):
+        return numpy.array([self.code(string) for string in strings],
+                           dtype=numpy.int32)
+
+    def decode(self, codes):
+        strings = self.strings
+        return [strings[code] for code in codes.tolist()]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+def pack_strings(strings):
+    """
+    the utf-8 buffer of strings and the offsets of the strings in it
+    """
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(item) for item in encoded], out=offsets[1:])
+    return b"".join(encoded), offsets
+
+
+def unpack_strings(buffer, offsets):
+    offsets = offsets.tolist()
+    return [
+        buffer[start:stop].decode("utf-8")
+        for start, stop in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+class Annotation(collections.abc.Mapping):
+    """
+    an annotation record with the columns of the objects as arrays,
+    read as a dict of the METADATA keys for compatibility:
+        bbox: float32 array of [xmin, ymin, xmax, ymax] rows, one column
+            per object
+        area: float32 array
+        difficulty, labels: int arrays
+        classes, languages: int32 codes of the strings in table
+        texts: utf-8 buffer of the object texts, split by text_offsets
+    """
+    __slots__ = ("image", "encoded", "format", "height", "width", "depth",
+                 "filename", "text", "text_labels", "text_length",
+                 "class_text", "class_label", "bbox", "area", "difficulty",
+                 "labels", "classes", "languages", "texts", "text_offsets",
+                 "table")
+
+    # METADATA key: (slot, bbox row, or how the slot is decoded)
+    KEYS = {
+        "image": ("image", None),
+        "image/encoded": ("encoded", None),
+        "image/format": ("format", None),
+        "image/height": ("height", None),
+        "image/width": ("width", None),
+        "image/depth": ("depth", None),
+        "image/filename": ("filename", None),
+        "image/text": ("text", None),
+        "image/text/label": ("text_labels", None),
+        "image/text/length": ("text_length", None),
+        "image/class/text": ("class_text", None),
+        "image/class/label": ("class_label", None),
+        "image/object/bbox/xmin": ("bbox", 0),
+        "image/object/bbox/ymin": ("bbox", 1),
+        "image/object/bbox/xmax": ("bbox", 2),
+        "image/object/bbox/ymax": ("bbox", 3),
+        "image/object/area": ("area", None),
+        "image/object/difficulty": ("difficulty", None),
+        "image/object/class/label": ("labels", None),
+        "image/object/class/text": ("classes", "table"),
+        "image/object/language": ("languages", "table"),
+        "image/object/text": ("texts", "buffer"),
     }
+
+    def __init__(self, table=None, **fields):
+        for slot in self.__slots__:
+            setattr(self, slot, fields.pop(slot, None))
+        if fields:
+            raise NameError("unexcepted annotation field '{}'".format(
+                next(iter(fields))))
+        self.table = table if table is not None else StringTable()
+
+    @classmethod
+    def from_dict(cls, annotation, table=None):
+        """
+        build the record from a dict of the METADATA keys
+        """
+        for name in annotation:
+            if name not in cls.KEYS:
+                raise NameError("unexcepted annotation key '{}'".format(name))
+        table = table if table is not None else StringTable()
+
+        def column(name, dtype):
+            value = annotation.get(name)
+            if value is None:
+                return None
+            return numpy.asarray(value, dtype=dtype)
+
+        def strings(name):
+            value = annotation.get(name)
+            if value is None:
+                return None
+            return table.encode(value)
+
+        bbox = None
+        if annotation.get(BBOX_KEYS[0]) is not None:
+            bbox = numpy.array(
+                [annotation[name] for name in BBOX_KEYS],
+                dtype=numpy.float32).reshape([4, -1])
+        texts, text_offsets = None, None
+        if annotation.get("image/object/text") is not None:
+            texts, text_offsets = pack_strings(annotation["image/object/text"])
+        labels = annotation.get("image/object/class/label")
+        if labels is not None and any(label is None for label in labels):
+            labels = None
+        return cls(
+            table=table,
+            image=annotation.get("image"),
+            encoded=annotation.get("image/encoded"),
+            format=annotation.get("image/format"),
+            height=annotation.get("image/height"),
+            width=annotation.get("image/width"),
+            depth=annotation.get("image/depth"),
+            filename=annotation.get("image/filename"),
+            text=annotation.get("image/text"),
+            text_labels=column("image/text/label", numpy.int64),
+            text_length=annotation.get("image/text/length"),
+            class_text=annotation.get("image/class/text"),
+            class_label=annotation.get("image/class/label"),
+            bbox=bbox,
+            area=column("image/object/area", numpy.float32),
+            difficulty=column("image/object/difficulty", numpy.uint8),
+            labels=None if labels is None else numpy.asarray(
+                labels, dtype=numpy.int32),
+            classes=strings("image/object/class/text"),
+            languages=strings("image/object/language"),
+            texts=texts,
+            text_offsets=text_offsets,
+        )
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __getitem__(self, key):
+        try:
+            slot, how = self.KEYS[key]
+        except KeyError:
+            raise KeyError(key)
+        value = getattr(self, slot)
+        if value is None:
+            raise KeyError(key)
+        if how is None:
+            return value
+        if how == "table":
+            return self.table.decode(value)
+        if how == "buffer":
+            return unpack_strings(value, self.text_offsets)
+        return value[how]
+
+    def __iter__(self):
+        for key, (slot, _) in self.KEYS.items():
+            if getattr(self, slot) is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "Annotation({!r}, {} objects)".format(
+            self.filename, 0 if self.bbox is None else self.bbox.shape[1])
+
+
+def reverse_strings(strings):
+    """
+    reverse all the strings of an array at once on their character codes
+    """
+    strings = numpy.asarray(strings)
+    if strings.dtype.kind not in ("U", "S"):
+        strings = strings.astype(str)
+    if not strings.size:
+        return strings
+    if strings.dtype.kind == "U":
+        codetype = numpy.uint32
+    else:
+        codetype = numpy.uint8
+    length = strings.dtype.itemsize // numpy.dtype(codetype).itemsize
+    codes = numpy.ascontiguousarray(strings).view(codetype).reshape(
+        [-1, length])
+    source = (numpy.char.str_len(strings).reshape([-1, 1]) - 1 -
+              numpy.arange(length))
+    codes = numpy.where(
+        source >= 0,
+        numpy.take_along_axis(codes, numpy.maximum(source, 0), axis=1), 0)
+    return codes.astype(codetype).view(strings.dtype).reshape(strings.shape)
+
+
+def rollover_image(annotation, copy=True):
+    """
+    flip the image of annotation in place, return the image width
+    """
     image_width = None
     if "image" in annotation:
-        annotation["image"] = annotation["image"][:, ::-1, :]
-        image_width = annotation["image"].shape[1]
+        image = annotation["image"][:, ::-1]
+        if copy:
+            image = numpy.ascontiguousarray(image)
+        annotation["image"] = image
+        image_width = image.shape[1]
+    elif "image/encoded" in annotation:
+        import cv2
+        image = cv2.imdecode(
+            numpy.frombuffer(annotation["image/encoded"], numpy.uint8),
+            cv2.IMREAD_UNCHANGED)
+        image_width = image.shape[1]
+        success, encoded = cv2.imencode(
+            ".{}".format(annotation.get("image/format", "png")),
+            image[:, ::-1])
+        if not success:
+            raise ValueError("failed to encode rollover image")
+        annotation["image/encoded"] = encoded.tobytes()
     if "image/width" in annotation:
         image_width = annotation["image/width"]
-    if "image/text" in annotation:
-        annotation["image/text"] = annotation["image/text"][::-1]
-    if "image/text/label" in annotation:
-        annotation["image/text/label"] = annotation["image/text/label"][::-1]
-
-    if (("image/object/bbox/xmin" in annotation)
-            and ("image/object/bbox/xmax" in annotation)
-            and (image_width is not None)):
-        length = min([
-            len(annotation["image/object/bbox/xmax"]),
-            len(annotation["image/object/bbox/xmin"])
-        ])
-        for index in range(length):
-            (xmin, xmax) = (
-                image_width - annotation["image/object/bbox/xmax"][index] - 1,
-                image_width - annotation["image/object/bbox/xmin"][index] - 1)
-            annotation["image/object/bbox/xmin"][index] = xmin
-            annotation["image/object/bbox/xmax"][index] = xmax
-
-    if "image/object/text" in annotation:
-        annotation["image/object/text"] = [
-            item[::-1] for item in annotation["image/object/text"]
+    return image_width
+
+
+def split(values, lengths):
+    return numpy.split(values, numpy.cumsum(lengths)[:-1])
+
+
+def rollovers(annotations, copy=True):
+    """
+    rollover() a batch of annotations, the boxes and the texts of the
+    whole batch are mirrored by single array operations.
+    copy: the flipped image is a contiguous copy instead of a view with a
+        negative stride
+    """
+    annotations = [{
+        key: value
+        for key, value in annotation.items() if value is not None
+    } for annotation in annotations]
+    image_widths = [
+        rollover_image(annotation, copy=copy) for annotation in annotations
+    ]
+    for annotation in annotations:
+        if "image/text" in annotation:
+            annotation["image/text"] = annotation["image/text"][::-1]
+        if "image/text/label" in annotation:
+            annotation["image/text/label"] = numpy.array(
+                annotation["image/text/label"][::-1])
+
+    boxed = [
+        (annotation, numpy.asarray(annotation["image/object/bbox/xmin"]),
+         numpy.asarray(annotation["image/object/bbox/xmax"]), image_width)
+        for annotation, image_width in zip(annotations, image_widths)
+        if "image/object/bbox/xmin" in annotation
+        and "image/object/bbox/xmax" in annotation
+        and image_width is not None
+    ]
+    if boxed:
+        lengths = [min(len(xmin), len(xmax)) for _, xmin, xmax, _ in boxed]
+        xmins = numpy.concatenate(
+            [xmin[:length] for (_, xmin, _, _), length in zip(boxed, lengths)])
+        xmaxs = numpy.concatenate(
+            [xmax[:length] for (_, _, xmax, _), length in zip(boxed, lengths)])
+        widths = numpy.repeat([item[3] for item in boxed], lengths)
+        for (annotation, xmin, xmax, _), length, mirrored_xmin, mirrored_xmax \
+                in zip(boxed, lengths, split(widths - xmaxs - 1, lengths),
+                       split(widths - xmins - 1, lengths)):
+            xmin = xmin.astype(numpy.result_type(xmin, mirrored_xmin))
+            xmax = xmax.astype(numpy.result_type(xmax, mirrored_xmax))
+            xmin[:length] = mirrored_xmin
+            xmax[:length] = mirrored_xmax
+            annotation["image/object/bbox/xmin"] = xmin
+            annotation["image/object/bbox/xmax"] = xmax
+
+    texts = [
+        annotation for annotation in annotations
+        if "image/object/text" in annotation
+    ]
+    if texts:
+        lengths = [
+            len(annotation["image/object/text"]) for annotation in texts
         ]
-    return annotation
+        strings = [
+            text for annotation in texts
+            for text in annotation["image/object/text"]
+        ]
+        for annotation, reversed_texts in zip(
+                texts, split(reverse_strings(strings), lengths)):
+            annotation["image/object/text"] = reversed_texts
+    return annotations
+
+
+def rollover(annotation, copy=True):
+    return rollovers([annotation], copy=copy)[0]
@@ -0,0 +1,232 @@
+"""
+tf.train.Example protobuf encoding without tensorflow
+
+    Example { Features features = 1; }
+    Features { map<string, Feature> feature = 1; }
+    Feature { oneof { BytesList bytes_list = 1; FloatList float_list = 2;
+                      Int64List int64_list = 3; } }
+the list values are field 1, packed for the floats and the int64s.
+"""
+import struct
+import numpy
+from .annotation import METADATA
+
+BYTES_LIST = 1
+FLOAT_LIST = 2
+INT64_LIST = 3
+KINDS = {"string": BYTES_LIST, "float32": FLOAT_LIST, "int64": INT64_LIST}
+
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH = 2
+WIRETYPE_FIXED32 = 5
+
+
+_VARINTS = [bytes([value]) for value in range(0x80)]
+
+
+def varint(value):
+    if 0 <= value < 0x80:
+        return _VARINTS[value]
+    # negative int64 values are encoded in two's complement of 10 bytes
+    value &= 0xFFFFFFFFFFFFFFFF
+    result = bytearray()
+    while value > 0x7F:
+        result.append((value & 0x7F) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def tag(field, wiretype=WIRETYPE_LENGTH):
+    return varint((field << 3) | wiretype)
+
+
+def length_delimited(field, data):
+    return b"".join((tag(field), varint(len(data)), data))
+
+
+def as_bytes(value):
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    # bytes(3) would be three NUL bytes, numpy.bytes_ is a bytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    raise TypeError("expected binary or unicode string, got {!r}".format(value))
+
+
+def encode_values(kind, values):
+    """
+    encode the value list message of a Feature
+    """
+    if kind == BYTES_LIST:
+        return b"".join(
+            length_delimited(1, as_bytes(value)) for value in values)
+    if kind == FLOAT_LIST:
+        data = numpy.asarray(values, dtype="<f4").tobytes()
+    else:
+        data = b"".join(varint(int(value)) for value in values)
+    if not data:
+        return b""
+    return length_delimited(1, data)
+
+
+class Encoder:
+    """
+    serialize examples of a schema, the map entry keys and the value kinds
+    of the features are computed once
+    """
+
+    def __init__(self, metadata=METADATA):
+        self.features = {}
+        for name, value in metadata.items():
+            self.features[name] = (
+                length_delimited(1, as_bytes(name)) + tag(2),
+                KINDS[value["type"]],
+                value["shape"] is not None and not value["shape"],
+            )
+
+    def encode_feature(self, name, value):
+        try:
+            key, kind, scalar = self.features[name]
+        except KeyError:
+            raise NameError("unexcepted feature name '{}'".format(name))
+        if scalar:
+            value = (value, )
+        elif isinstance(value, numpy.ndarray):
+            value = value.reshape([-1])
+        data = length_delimited(kind, encode_values(kind, value))
+        entry = b"".join((key, varint(len(data)), data))
+        return b"".join((_ENTRY_TAG, varint(len(entry)), entry))
+
+    def encode(self, feature):
+        """
+        serialize a dict of features, the None values are skipped
+        """
+        encode_feature = self.encode_feature
+        entries = b"".join(
+            encode_feature(name, value) for name, value in feature.items()
+            if value is not None)
+        return b"".join((_ENTRY_TAG, varint(len(entries)), entries))
+
+
+_ENTRY_TAG = tag(1)
+ENCODER = Encoder()
+
+
+def encode_example(feature, metadata=METADATA):
+    if metadata is METADATA:
+        return ENCODER.encode(feature)
+    return Encoder(metadata).encode(feature)
+
+
+class Example:
+    """
+    a serialized example, in place of tf.train.Example
+    """
+    __slots__ = ("serialized", )
+
+    def __init__(self, serialized):
+        self.serialized = serialized
+
+    def SerializeToString(self):
+        return self.serialized
+
+    def ByteSize(self):
+        return len(self.serialized)
+
+
+def read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def fields(data):
+    """
+    yield (field, wiretype, value) of a message
+    """
+    position = 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        field, wiretype = key >> 3, key & 0x07
+        if wiretype == WIRETYPE_VARINT:
+            value, position = read_varint(data, position)
+        elif wiretype == WIRETYPE_LENGTH:
+            length, position = read_varint(data, position)
+            value = data[position:position + length]
+            position += length
+        elif wiretype == WIRETYPE_FIXED32:
+            value = data[position:position + 4]
+            position += 4
+        elif wiretype == WIRETYPE_FIXED64:
+            value = data[position:position + 8]
+            position += 8
+        else:
+            raise ValueError("unsupported wiretype {}".format(wiretype))
+        yield field, wiretype, value
+
+
+def int64(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def decode_values(kind, data):
+    values = []
+    for field, wiretype, value in fields(data):
+        if field != 1:
+            continue
+        if kind == BYTES_LIST:
+            values.append(bytes(value))
+        elif kind == FLOAT_LIST:
+            if wiretype == WIRETYPE_LENGTH:
+                values.extend(numpy.frombuffer(value, dtype="<f4").tolist())
+            else:
+                values.append(struct.unpack("<f", value)[0])
+        elif wiretype == WIRETYPE_LENGTH:
+            position = 0
+            while position < len(value):
+                item, position = read_varint(value, position)
+                values.append(int64(item))
+        else:
+            values.append(int64(value))
+    return values
+
+
+def decode_feature(data):
+    for kind, _, value in fields(data):
+        if kind in (BYTES_LIST, FLOAT_LIST, INT64_LIST):
+            return decode_values(kind, value)
+    return []
+
+
+def decode_example(serialized, metadata=METADATA):
+    """
+    the values of the features as lists, unwrapped for the scalar features
+    """
+    serialized = memoryview(serialized)
+    feature = {}
+    for field, _, features in fields(serialized):
+        if field != 1:
+            continue
+        for field, _, entry in fields(features):
+            if field != 1:
+                continue
+            name, value = None, b""
+            for field, _, item in fields(entry):
+                if field == 1:
+                    name = bytes(item).decode("utf-8")
+                elif field == 2:
+                    value = item
+            values = decode_feature(value)
+            if (name in metadata and metadata[name]["shape"] is not None
+                    and not metadata[name]["shape"]):
+                values = values[0] if values else None
+            feature[name] = values
+    return feature
@@ -0,0 +1,269 @@
+"""
+TFRecord framing with an optional sidecar index for random access
+
+each record is framed as
+    uint64 length, uint32 masked crc32c of length,
+    byte data[length], uint32 masked crc32c of data
+and the compressed shards are plain GZIP/ZLIB streams readable by tensorflow.
+with block_size, the compressor is fully flushed every block_size records,
+so the decompression of a record can start at the beginning of its block.
+
+the index is a json lines file, the first line holds the compression type,
+the others hold the "block" (compressed offset where the block starts),
+the "offset" (uncompressed offset of the record inside the block),
+the "length" of the record and the key fields given to write().
+"""
+import json
+import os
+import struct
+import zlib
+
+try:
+    import crc32c as _crc32c
+except ImportError:
+    _crc32c = None
+
+
+def _crc32c_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0x82F63B78
+            else:
+                crc >>= 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _crc32c_table()
+
+
+def crc32c(data):
+    if _crc32c is not None:
+        return _crc32c.crc32c(data)
+    crc = 0xFFFFFFFF
+    table = _CRC32C_TABLE
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def masked_crc32c(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+# the values of tf.python_io.TFRecordCompressionType
+COMPRESSION_TYPES = {0: "", 1: "ZLIB", 2: "GZIP", None: ""}
+WBITS = {"ZLIB": zlib.MAX_WBITS, "GZIP": zlib.MAX_WBITS | 16}
+
+
+def compression_type_string(compression_type):
+    if not isinstance(compression_type, str):
+        compression_type = COMPRESSION_TYPES[compression_type]
+    compression_type = compression_type.upper()
+    if compression_type and compression_type not in WBITS:
+        raise ValueError(
+            "unexcepted compression type '{}'".format(compression_type))
+    return compression_type
+
+
+def index_filename(filename):
+    return "{}.index".format(filename)
+
+
+def frame(record):
+    length = struct.pack("<Q", len(record))
+    return b"".join((length, struct.pack("<I", masked_crc32c(length)),
+                     record, struct.pack("<I", masked_crc32c(record))))
+
+
+class RecordWriter:
+    def __init__(self,
+                 filename,
+                 compression_type="",
+                 index=False,
+                 block_size=None,
+                 compression_level=zlib.Z_DEFAULT_COMPRESSION):
+        """
+        index: write the index to index_filename(filename)
+        block_size: records per independently decompressible block
+        """
+        self.compression_type = compression_type_string(compression_type)
+        self.block_size = block_size
+        self.file = open(filename, "wb")
+        self.compressor = None
+        if self.compression_type:
+            self.compressor = zlib.compressobj(compression_level,
+                                               zlib.DEFLATED,
+                                               WBITS[self.compression_type])
+        self.index = None
+        if index:
+            self.index = open(index_filename(filename), "w")
+            self.index.write(
+                json.dumps({
+                    "compression_type": self.compression_type
+                }) + "\n")
+        self.block = 0
+        self.offset = 0
+        self.count = 0
+
+    def write(self, record, fields=None):
+        data = frame(record)
+        if self.index is not None:
+            entry = {
+                "block": self.block,
+                "offset": self.offset,
+                "length": len(record),
+            }
+            if fields:
+                entry.update(fields)
+            self.index.write(json.dumps(entry) + "\n")
+        if self.compressor is None:
+            self.file.write(data)
+        else:
+            self.file.write(self.compressor.compress(data))
+        self.offset += len(data)
+        self.count += 1
+        if (self.compressor is not None and self.block_size
+                and self.count % self.block_size == 0):
+            self.file.write(self.compressor.flush(zlib.Z_FULL_FLUSH))
+            self.block = self.file.tell()
+            self.offset = 0
+
+    def flush(self):
+        self.file.flush()
+        if self.index is not None:
+            self.index.flush()
+
+    def close(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush())
+            self.compressor = None
+        self.file.close()
+        if self.index is not None:
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _Stream:
+    """
+    the uncompressed bytes of a shard from the beginning of a block
+    """
+
+    def __init__(self, file, compression_type, block=0, chunk_size=1 << 16):
+        self.file = file
+        self.file.seek(block)
+        self.chunk_size = chunk_size
+        self.buffer = b""
+        self.decompressor = None
+        if compression_type:
+            # a flush point is a raw deflate stream without header
+            wbits = WBITS[compression_type] if block == 0 else -zlib.MAX_WBITS
+            self.decompressor = zlib.decompressobj(wbits)
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            data = self.file.read(self.chunk_size)
+            if not data:
+                break
+            if self.decompressor is not None:
+                data = self.decompressor.decompress(data)
+            self.buffer += data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def skip(self, size):
+        while size > 0:
+            size -= len(self.read(min(size, self.chunk_size)))
+
+    def record(self, check=True):
+        header = self.read(12)
+        if not header:
+            return None
+        if len(header) < 12:
+            raise IOError("truncated record header")
+        length, length_crc = struct.unpack("<QI", header)
+        if check and masked_crc32c(header[:8]) != length_crc:
+            raise IOError("corrupted record length")
+        data = self.read(length + 4)
+        if len(data) < length + 4:
+            raise IOError("truncated record")
+        record = data[:length]
+        if check and masked_crc32c(record) != struct.unpack(
+                "<I", data[length:])[0]:
+            raise IOError("corrupted record data")
+        return record
+
+
+class RecordReader:
+    def __init__(self, filename, index=None, compression_type=None,
+                 check=True):
+        """
+        index: the index file, index_filename(filename) by default
+        compression_type: taken from the index if not given
+        """
+        self.filename = filename
+        self.indexfile = index or index_filename(filename)
+        if compression_type is None and os.path.exists(self.indexfile):
+            with open(self.indexfile) as indexfile:
+                compression_type = json.loads(
+                    indexfile.readline())["compression_type"]
+        self.compression_type = compression_type_string(compression_type)
+        self.check = check
+        self.file = open(filename, "rb")
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            with open(self.indexfile) as indexfile:
+                indexfile.readline()
+                self._entries = [json.loads(line) for line in indexfile]
+        return self._entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        """
+        read all the records sequentially, no index is needed
+        """
+        stream = _Stream(self.file, self.compression_type)
+        while True:
+            record = stream.record(check=self.check)
+            if record is None:
+                return
+            yield record
+
+    def read(self, number):
+        return self.read_range(number, number + 1)[0]
+
+    def read_range(self, start, stop):
+        entries = self.entries[start:stop]
+        if not entries:
+            return []
+        if self.compression_type:
+            stream = _Stream(self.file, self.compression_type,
+                             entries[0]["block"])
+            stream.skip(entries[0]["offset"])
+        else:
+            stream = _Stream(self.file, self.compression_type,
+                             entries[0]["block"] + entries[0]["offset"])
+        return [stream.record(check=self.check) for _ in entries]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
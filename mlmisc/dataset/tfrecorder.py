@@ -1,32 +1,55 @@
-import tensorflow as tf
+"""
+writing needs no tensorflow, it is only imported to build the input
+pipelines and the tf.train.Example objects
+"""
 import logging
+import os
 import numpy
 from .annotation import METADATA
+from . import recordio
+from . import protobuf
+
+# tf.data.experimental.AUTOTUNE
+AUTOTUNE = -1
+
+
+def _tf():
+    """
+    the tensorflow module, imported on first use
+    """
+    import tensorflow
+    return tensorflow
 
 
 def int64_feature(value):
+    tf = _tf()
     return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
 
 
 def int64_list_feature(value):
+    tf = _tf()
     return tf.train.Feature(int64_list=tf.train.Int64List(value=value))
 
 
 def float_feature(value):
+    tf = _tf()
     return tf.train.Feature(float_list=tf.train.FloatList(value=[value]))
 
 
 def float_list_feature(value):
+    tf = _tf()
     return tf.train.Feature(float_list=tf.train.FloatList(value=value))
 
 
 def bytes_feature(value):
+    tf = _tf()
     return tf.train.Feature(
         bytes_list=tf.train.BytesList(
             value=None if value is None else [tf.compat.as_bytes(value)]))
 
 
 def bytes_list_feature(value):
+    tf = _tf()
     return tf.train.Feature(
         bytes_list=tf.train.BytesList(
             value=None if value is None else
@@ -34,7 +57,23 @@ def bytes_list_feature(value):
 
 
 def writer(filename,
-           compression_type=tf.python_io.TFRecordCompressionType.GZIP):
+           compression_type="GZIP",
+           index=False,
+           block_size=None,
+           tensorflow=False):
+    """
+    index: also write the record offsets and key fields to a sidecar index,
+        records are then written by writer.write(record, fields)
+    block_size: make compressed shards seekable every block_size records
+    tensorflow: use tf.python_io.TFRecordWriter
+    """
+    if not tensorflow:
+        return recordio.RecordWriter(
+            filename,
+            compression_type=compression_type,
+            index=index,
+            block_size=block_size)
+    tf = _tf()
     return tf.python_io.TFRecordWriter(
         filename,
         options=tf.python_io.TFRecordOptions(
@@ -42,6 +81,7 @@ def writer(filename,
 
 
 def metadata2feature(metadata):
+    tf = _tf()
     feature = {"parser": None, "converter": None}
     typedict = {
         "int64": tf.int64,
@@ -77,66 +117,372 @@ def metadata2feature(metadata):
     return feature
 
 
-FEATURE = {key: metadata2feature(value) for key, value in METADATA.items()}
+class _Features(dict):
+    """
+    the dict of FEATURE, filled from METADATA when it is first read,
+    as building the parsers imports tensorflow
+    """
+    def fill(self):
+        if not self.filled:
+            self.filled = True
+            dict.update(
+                self, {
+                    key: metadata2feature(value)
+                    for key, value in METADATA.items()
+                })
+        return self
 
+    filled = False
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self.fill(), key)
+
+    def __iter__(self):
+        return dict.__iter__(self.fill())
+
+    def __len__(self):
+        return dict.__len__(self.fill())
+
+    def __contains__(self, key):
+        return dict.__contains__(self.fill(), key)
+
+    def __eq__(self, other):
+        return dict.__eq__(self.fill(), other)
+
+    def __ne__(self, other):
+        return dict.__ne__(self.fill(), other)
+
+    def __repr__(self):
+        return dict.__repr__(self.fill())
+
+    def get(self, key, default=None):
+        return dict.get(self.fill(), key, default)
+
+    def keys(self):
+        return dict.keys(self.fill())
+
+    def values(self):
+        return dict.values(self.fill())
+
+    def items(self):
+        return dict.items(self.fill())
+
+    def copy(self):
+        return dict(self.items())
+
+
+# kept for the callers of the former module attribute, prefer features()
+FEATURE = _Features()
 
-def example(feature):
-    feature = {
-        name: value
-        for name, value in feature.items() if value is not None
-    }
-    if "image" in feature and hasattr(feature["image"], "shape"):
-        image_shape = feature["image"].shape
-        if len(image_shape) > 1:
-            for index, name in enumerate(("image/height", "image/width",
-                                          "image/depth")):
-                if name not in feature:
-                    if len(image_shape) > index:
-                        feature[name] = image_shape[index]
-                    else:
-                        feature[name] = 1
-        feature["image"] = numpy.reshape(feature["image"], [-1])
-        feature["image"] = feature["image"].astype(numpy.int64)
 
+def features():
+    """
+    the tensorflow parsers and converters of METADATA, built on first use
+    """
+    return FEATURE.fill()
+
+
+def encode_image(image, image_format="png"):
+    import cv2
+    success, encoded = cv2.imencode(".{}".format(image_format), image)
+    if not success:
+        raise ValueError("failed to encode image as '{}'".format(image_format))
+    return encoded.tobytes()
+
+
+def image_feature(feature, image_format="png"):
+    """
+    replace the image array of feature by its encoded bytes,
+    feature is only copied if it holds an image array
+    """
+    image = feature.get("image")
+    if not hasattr(image, "shape"):
+        return feature
+    feature = dict(feature)
+    del feature["image"]
+    image_shape = image.shape
+    if len(image_shape) > 1:
+        for index, name in enumerate(("image/height", "image/width",
+                                      "image/depth")):
+            if feature.get(name) is None:
+                if len(image_shape) > index:
+                    feature[name] = image_shape[index]
+                else:
+                    feature[name] = 1
+    if feature.get("image/encoded") is not None:
+        pass
+    elif image_format == "raw":
+        feature["image"] = numpy.ascontiguousarray(
+            image, dtype=numpy.uint8).tobytes()
+    else:
+        feature["image/encoded"] = encode_image(image, image_format)
+        feature["image/format"] = image_format
+    return feature
+
+
+def log_example(feature):
     logging.debug("logging example begins:")
     for name, value in feature.items():
-        if name not in FEATURE:
-            raise NameError("unexcepted feature name '{}'".format(name))
-        if name not in ("image"):
-            logging.debug("{}: {}".format(name, value))
+        if value is not None and name not in ("image", "image/encoded"):
+            logging.debug("%s: %s", name, value)
     logging.debug("logging example ends.\n")
-    feature = {
-        name: FEATURE[name]["converter"](value)
-        for name, value in feature.items()
-    }
-    return tf.train.Example(features=tf.train.Features(feature=feature))
 
 
-def parse_single_example(example_proto):
-    feature = tf.parse_single_example(
-        example_proto,
-        {name: value["parser"]
-         for name, value in FEATURE.items()})
-    for name in FEATURE:
-        if name in feature:
-            if FEATURE[name]["parser"].dtype == tf.string:
-                default_value = ""
-            else:
-                default_value = 0
-            if isinstance(FEATURE[name]["parser"], tf.VarLenFeature):
-                feature[name] = tf.sparse_tensor_to_dense(
-                    feature[name], default_value=default_value)
-    if "image" in feature:
-        feature["image"] = tf.reshape(
-            feature["image"],
+def example(feature, image_format="png", tensorflow=False):
+    """
+    the image array is stored encoded as "image/encoded" in image_format,
+    image_format="raw" stores the pixels as uint8 bytes in "image" instead.
+    an "image/encoded" given by the caller is passed through as it is.
+    tensorflow: return a tf.train.Example instead of a protobuf.Example
+    """
+    feature = image_feature(feature, image_format)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        log_example(feature)
+    serialized = protobuf.ENCODER.encode(feature)
+    if tensorflow:
+        tf = _tf()
+        return tf.train.Example.FromString(serialized)
+    return protobuf.Example(serialized)
+
+
+def examples(features, image_format="png"):
+    """
+    the serialized examples of a list of features
+    """
+    encode = protobuf.ENCODER.encode
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    serialized = []
+    for feature in features:
+        feature = image_feature(feature, image_format)
+        if debug:
+            log_example(feature)
+        serialized.append(encode(feature))
+    return serialized
+
+
+def decode_image(feature, channels=0):
+    """
+    decode "image/encoded" if present, otherwise the raw uint8 "image"
+    """
+    tf = _tf()
+
+    def decode_raw():
+        return tf.reshape(
+            tf.decode_raw(feature["image"], tf.uint8),
             tf.cast([
                 feature["image/height"], feature["image/width"],
                 feature["image/depth"]
             ], tf.int32))
+
+    def decode_encoded():
+        return tf.image.decode_image(
+            feature["image/encoded"], channels=channels)
+
+    image = tf.cond(
+        tf.equal(feature["image/encoded"], ""), decode_raw, decode_encoded)
+    image.set_shape([None, None, None])
+    return image
+
+
+IMAGE_KEYS = ("image", "image/encoded", "image/height", "image/width",
+              "image/depth")
+
+
+def parsers(keys=None):
+    """
+    the parser spec restricted to keys, decoding "image" needs IMAGE_KEYS
+    """
+    if keys is None:
+        keys = METADATA.keys()
+    keys = set(keys)
+    if "image" in keys:
+        keys.update(IMAGE_KEYS)
+    for name in keys:
+        if name not in METADATA:
+            raise NameError("unexcepted feature name '{}'".format(name))
+    return {name: features()[name]["parser"] for name in keys}
+
+
+def densify(feature, ragged=False):
+    """
+    convert the parsed VarLen features to padded dense or ragged tensors
+    """
+    tf = _tf()
+    for name, value in feature.items():
+        if not isinstance(features()[name]["parser"], tf.VarLenFeature):
+            continue
+        if ragged:
+            feature[name] = tf.RaggedTensor.from_sparse(value)
+        else:
+            if features()[name]["parser"].dtype == tf.string:
+                default_value = ""
+            else:
+                default_value = 0
+            feature[name] = tf.sparse_tensor_to_dense(
+                value, default_value=default_value)
+    return feature
+
+
+def parse_single_example(example_proto, keys=None):
+    tf = _tf()
+    feature = tf.parse_single_example(example_proto, parsers(keys))
+    feature = densify(feature)
+    if "image" in feature:
+        feature["image"] = decode_image(feature)
     return feature
 
 
-def dataset(filenames, compression_type="GZIP"):
-    return tf.data.TFRecordDataset(
-        filenames=filenames,
-        compression_type=compression_type).map(parse_single_example)
+def parse_example(serialized, keys=None, ragged=False):
+    """
+    parse a batch of serialized examples with one parse call,
+    images stay undecoded since their shapes differ within a batch
+    """
+    tf = _tf()
+    feature = tf.parse_example(serialized, parsers(keys))
+    return densify(feature, ragged=ragged)
+
+
+def reverse_string(string):
+    tf = _tf()
+    return tf.strings.reduce_join(
+        tf.reverse(tf.strings.unicode_split(string, "UTF-8"), [0]))
+
+
+def rollover(feature, probability=0.5):
+    """
+    flip a parsed example horizontally with probability, as
+    annotation.rollover() does at conversion time: the image is flipped,
+    the boxes are mirrored against the image width, and the texts and the
+    text labels are reversed
+    """
+    tf = _tf()
+
+    def flip():
+        flipped = dict(feature)
+        if "image" in feature:
+            flipped["image"] = tf.reverse(feature["image"], [1])
+        if "image/width" in feature:
+            width = feature["image/width"]
+        elif "image" in feature:
+            width = tf.shape(feature["image"])[1]
+        else:
+            width = None
+        if "image/text" in feature:
+            flipped["image/text"] = reverse_string(feature["image/text"])
+        if "image/text/label" in feature:
+            flipped["image/text/label"] = tf.reverse(
+                feature["image/text/label"], [0])
+        if ("image/object/bbox/xmin" in feature
+                and "image/object/bbox/xmax" in feature
+                and width is not None):
+            width = tf.cast(width, tf.float32)
+            flipped["image/object/bbox/xmin"] = (
+                width - feature["image/object/bbox/xmax"] - 1)
+            flipped["image/object/bbox/xmax"] = (
+                width - feature["image/object/bbox/xmin"] - 1)
+        if "image/object/text" in feature:
+            flipped["image/object/text"] = tf.map_fn(
+                reverse_string,
+                feature["image/object/text"],
+                dtype=tf.string)
+        return flipped
+
+    return tf.cond(
+        tf.random_uniform([]) < probability, flip, lambda: dict(feature))
+
+
+def dataset(filenames,
+            compression_type="GZIP",
+            keys=None,
+            batch_size=None,
+            ragged=False,
+            drop_remainder=False,
+            rollover_probability=0):
+    """
+    keys: only parse the given feature names
+    batch_size: batch the serialized records and parse them by parse_example
+    rollover_probability: flip the examples on the fly by rollover(),
+        not supported with batch_size
+    """
+    tf = _tf()
+    records = tf.data.TFRecordDataset(
+        filenames=filenames, compression_type=compression_type)
+    if batch_size is None:
+        parsed = records.map(
+            lambda example_proto: parse_single_example(example_proto, keys))
+        if rollover_probability:
+            parsed = parsed.map(
+                lambda feature: rollover(feature, rollover_probability))
+        return parsed
+    if rollover_probability:
+        raise ValueError("rollover is not supported for batched parsing")
+    return records.batch(
+        batch_size, drop_remainder=drop_remainder).map(
+            lambda serialized: parse_example(serialized, keys, ragged))
+
+
+def image_size(feature):
+    tf = _tf()
+    shape = tf.shape(feature["image"])
+    return tf.cast(tf.maximum(shape[0], shape[1]), tf.int32)
+
+
+def pipeline(filenames,
+             compression_type="GZIP",
+             keys=None,
+             cycle_length=None,
+             num_parallel_calls=AUTOTUNE,
+             shuffle=None,
+             cache=None,
+             batch_size=None,
+             bucket_boundaries=None,
+             bucket_key=image_size,
+             rollover_probability=0,
+             prefetch=AUTOTUNE):
+    """
+    cycle_length: number of shards read in parallel, by default the number
+        of cpus (at most the number of shards)
+    shuffle: shuffle buffer size, shards are shuffled too if set
+    cache: cache the serialized records, "" in memory, or to a file prefix
+    batch_size: padded batching of the parsed examples
+    bucket_boundaries: batch the examples in buckets of bucket_key,
+        the image size by default
+    rollover_probability: flip the examples on the fly by rollover()
+    """
+    tf = _tf()
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    files = tf.data.Dataset.from_tensor_slices(filenames)
+    if shuffle:
+        files = files.shuffle(len(filenames))
+    records = files.interleave(
+        lambda filename: tf.data.TFRecordDataset(
+            filename, compression_type=compression_type),
+        cycle_length=cycle_length
+        or min(len(filenames), os.cpu_count() or 1),
+        num_parallel_calls=num_parallel_calls)
+    if cache is not None:
+        records = records.cache(cache)
+    if shuffle:
+        records = records.shuffle(shuffle)
+    parsed = records.map(
+        lambda example_proto: parse_single_example(example_proto, keys),
+        num_parallel_calls=num_parallel_calls)
+    if rollover_probability:
+        parsed = parsed.map(
+            lambda feature: rollover(feature, rollover_probability),
+            num_parallel_calls=num_parallel_calls)
+    if batch_size is not None:
+        if bucket_boundaries:
+            parsed = parsed.apply(
+                tf.data.experimental.bucket_by_sequence_length(
+                    bucket_key,
+                    bucket_boundaries=bucket_boundaries,
+                    bucket_batch_sizes=[batch_size] *
+                    (len(bucket_boundaries) + 1)))
+        else:
+            parsed = parsed.padded_batch(
+                batch_size, padded_shapes=parsed.output_shapes)
+    if prefetch is not None:
+        parsed = parsed.prefetch(prefetch)
+    return parsed
@@ -146,6 +146,67 @@ def denoise(image):
     )
 
 
+def overlap_pairs(bboxes, min_gap=16, chunk_size=256):
+    """
+    the index pairs (i < j) of the (xmin, ymin, xmax, ymax) boxes whose gap
+    is at most min_gap on both axes, the candidates are found by sweeping the
+    boxes sorted along x
+    """
+    count = len(bboxes)
+    if count < 2:
+        return numpy.zeros([2, 0], dtype=numpy.int64)
+    # the x intervals padded by the gap cover the boxes overlapping on x
+    padding = max(min_gap, 0) / 2 + 1e-9 * (1 + numpy.abs(bboxes).max())
+    low = numpy.minimum(bboxes[:, 0], bboxes[:, 2]) - padding
+    high = numpy.maximum(bboxes[:, 0], bboxes[:, 2]) + padding
+    order = numpy.argsort(low, kind="stable")
+    ends = numpy.searchsorted(low[order], high[order], side="right")
+    pairs = []
+    for start in range(0, count, chunk_size):
+        rows = numpy.arange(start, min(start + chunk_size, count))
+        counts = numpy.maximum(ends[rows] - rows - 1, 0)
+        first = numpy.repeat(rows, counts)
+        offsets = numpy.arange(len(first)) - numpy.repeat(
+            numpy.cumsum(counts) - counts, counts)
+        second = first + 1 + offsets
+        first, second = order[first], order[second]
+        box1, box2 = bboxes[first], bboxes[second]
+        overlap = numpy.ones(len(first), dtype=bool)
+        for low_axis, high_axis in ((0, 2), (1, 3)):
+            min1, max1 = box1[:, low_axis], box1[:, high_axis]
+            min2, max2 = box2[:, low_axis], box2[:, high_axis]
+            distance = numpy.abs((min1 + max1) / 2 - (min2 + max2) / 2)
+            overlap &= ~((distance -
+                          (max1 - min1 + max2 - min2) / 2) > min_gap)
+        pairs.append(
+            numpy.stack([
+                numpy.minimum(first[overlap], second[overlap]),
+                numpy.maximum(first[overlap], second[overlap]),
+            ]))
+    return numpy.concatenate(pairs, axis=1)
+
+
+def connected_components(count, pairs):
+    """
+    union-find over the index pairs, the label of an index is the smallest
+    index of its component
+    """
+    parent = list(range(count))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    for first, second in zip(*pairs.tolist()):
+        root1, root2 = find(first), find(second)
+        if root1 != root2:
+            parent[max(root1, root2)] = min(root1, root2)
+    return numpy.array([find(index) for index in range(count)],
+                       dtype=numpy.int64)
+
+
 def merge_bboxes(
         bboxes,
         min_gap=16,
@@ -153,66 +214,46 @@ def merge_bboxes(
         max_area=None,
         min_area_perimeter_ratio=4,
 ):
-    def overlap(bbox1, bbox2):
-        def axis_overlap(min1, max1, min2, max2):
-            distance = abs((min1 + max1) / 2 - (min2 + max2) / 2)
-            if (distance - (max1 - min1 + max2 - min2) / 2) > min_gap:
-                return False
-            return True
-
-        return (axis_overlap(
-            bbox1[0],
-            bbox1[2],
-            bbox2[0],
-            bbox2[2],
-        ) and axis_overlap(
-            bbox1[1],
-            bbox1[3],
-            bbox2[1],
-            bbox2[3],
-        ))
-
+    """
+    merge the (xmin, ymin, xmax, ymax) boxes transitively closer than
+    min_gap on both axes, the groups are ordered by their last box
+    """
+    bboxes = numpy.asarray(bboxes).reshape([-1, 4])
     if min_area is not None:
         tiny_threshold = int(numpy.sqrt(min_area) / 4)
-        bboxes = [
-            bbox for bbox in bboxes
-            if tiny_threshold < (bbox[2] - bbox[0]) and tiny_threshold <
-            (bbox[3] - bbox[1])
-        ]
-
-    groups = []
-    while bboxes:
-        group = [bboxes.pop()]
-        grouped_indexes = []
-        for current in group:
-            for index, box in enumerate(bboxes):
-                if index in grouped_indexes:
-                    continue
-                if overlap(box, current):
-                    grouped_indexes.append(index)
-                    group.append(box)
-        groups.append(group)
-        bboxes = [
-            bboxes[index] for index in range(len(bboxes))
-            if index not in grouped_indexes
-        ]
-    bboxes = []
-    for group in groups:
-        xmin = min([item[0] for item in group])
-        ymin = min([item[1] for item in group])
-        xmax = max([item[2] for item in group])
-        ymax = max([item[3] for item in group])
-        area = (xmax - xmin) * (ymax - ymin)
-        perimeter = 2 * (xmax - xmin + ymax - ymin)
-        if min_area is not None and area < min_area:
-            continue
-        if max_area is not None and area > max_area:
-            continue
-        if (min_area_perimeter_ratio is not None
-                and area / perimeter < min_area_perimeter_ratio):
-            continue
-        bboxes.append((xmin, ymin, xmax, ymax))
-    return bboxes
+        bboxes = bboxes[(tiny_threshold < (bboxes[:, 2] - bboxes[:, 0]))
+                        & (tiny_threshold < (bboxes[:, 3] - bboxes[:, 1]))]
+    if not len(bboxes):
+        return []
+
+    labels = connected_components(
+        len(bboxes), overlap_pairs(bboxes.astype(numpy.float64), min_gap))
+    roots, groups = numpy.unique(labels, return_inverse=True)
+    last = numpy.zeros(len(roots), dtype=numpy.int64)
+    numpy.maximum.at(last, groups, numpy.arange(len(bboxes)))
+    merged = numpy.empty([len(roots), 4], dtype=bboxes.dtype)
+    merged[:, :2] = bboxes[roots, :2]
+    merged[:, 2:] = bboxes[roots, 2:]
+    numpy.minimum.at(merged[:, 0], groups, bboxes[:, 0])
+    numpy.minimum.at(merged[:, 1], groups, bboxes[:, 1])
+    numpy.maximum.at(merged[:, 2], groups, bboxes[:, 2])
+    numpy.maximum.at(merged[:, 3], groups, bboxes[:, 3])
+    merged = merged[numpy.argsort(-last, kind="stable")]
+
+    xmin, ymin, xmax, ymax = merged.T
+    area = (xmax - xmin) * (ymax - ymin)
+    perimeter = 2 * (xmax - xmin + ymax - ymin)
+    keep = numpy.ones(len(merged), dtype=bool)
+    if min_area is not None:
+        keep &= ~(area < min_area)
+    if max_area is not None:
+        keep &= ~(area > max_area)
+    if min_area_perimeter_ratio is not None:
+        if numpy.any(keep & (perimeter == 0)):
+            raise ZeroDivisionError("division by zero")
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            keep &= ~(area / perimeter < min_area_perimeter_ratio)
+    return [tuple(bbox) for bbox in merged[keep].tolist()]
 
 
 def detect_regions(image):
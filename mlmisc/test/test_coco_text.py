@@ -0,0 +1,76 @@
+import io
+import json
+import unittest
+from mlmisc.thirdparty.coco_text import coco_text
+
+
+class IterJsonTest(unittest.TestCase):
+    DOCUMENT = json.dumps({
+        "cats": 3.14159,
+        "info": 1,
+        "imgs": {
+            "1": {
+                "id": 1,
+                "file_name": "a \"b\"\\c.jpg",
+                "set": "train",
+                "width": 640,
+                "height": 480
+            },
+            "22": {
+                "id": 22,
+                "file_name": "é.jpg",
+                "set": "val",
+                "width": 1e5,
+                "height": -2.5E-3
+            },
+        },
+        "anns": {
+            "7": {
+                "bbox": [1.5, 2, 30.25, -4e-2],
+                "legible": True,
+                "utf8_string": None
+            },
+        },
+        "imgToAnns": {
+            "1": [7],
+            "22": []
+        },
+        "version": [1.1, "1.1", False],
+        "size": -12345,
+    }, indent=1)
+
+    def parse(self, text, chunk_size):
+        document = {}
+        for key, entry, value in coco_text.iterJson(
+                io.StringIO(text), chunk_size=chunk_size):
+            if entry is None:
+                document[key] = value
+            else:
+                document.setdefault(key, {})[entry] = value
+        return document
+
+    def test_chunk_sizes(self):
+        expected = json.loads(self.DOCUMENT)
+        for chunk_size in range(1, len(self.DOCUMENT) + 2):
+            self.assertEqual(
+                self.parse(self.DOCUMENT, chunk_size), expected,
+                "chunk_size={}".format(chunk_size))
+
+    def test_compact(self):
+        text = '{"cats": 3.14159, "info": 1}'
+        for chunk_size in range(1, len(text) + 2):
+            self.assertEqual(
+                self.parse(text, chunk_size), json.loads(text),
+                "chunk_size={}".format(chunk_size))
+
+    def test_empty(self):
+        self.assertEqual(self.parse("{}", 1), {})
+        self.assertEqual(self.parse('{"anns": {}, "n": 0}', 1), {"n": 0})
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            self.parse('{"cats": 3.x}', 1 << 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import numpy
+from mlmisc.dataset import protobuf
+
+
+class EncodeExampleTest(unittest.TestCase):
+    # serialized by tf.train.Example.SerializeToString()
+    EXAMPLES = [
+        ({
+            "image/filename": "a.png"
+        }, "0a1d0a1b0a0e696d6167652f66696c656e616d6512090a070a05612e706e67"),
+        ({
+            "image/height": 7
+        }, "0a170a150a0c696d6167652f68656967687412051a030a0107"),
+        ({
+            "image/object/bbox/xmin": [1.5, -2.0]
+        }, "0a280a260a16696d6167652f6f626a6563742f62626f782f786d696e120c120a"
+         "0a080000c03f000000c0"),
+        ({
+            "image/object/class/label": [-1, 300]
+        }, "0a2e0a2c0a18696d6167652f6f626a6563742f636c6173732f6c6162656c1210"
+         "1a0e0a0cffffffffffffffffff01ac02"),
+        ({
+            "image/object/text": []
+        }, "0a190a170a11696d6167652f6f626a6563742f7465787412020a00"),
+    ]
+
+    def test_tensorflow_bytes(self):
+        for feature, serialized in self.EXAMPLES:
+            self.assertEqual(
+                protobuf.encode_example(feature), bytes.fromhex(serialized))
+
+    def test_round_trip(self):
+        feature = {
+            "image/filename": "a.png",
+            "image/height": 480,
+            "image/width": 640,
+            "image/encoded": b"\x89PNG\x00\xff",
+            "image/object/bbox/xmin": numpy.array([1.5, -2.0, 1e6],
+                                                  dtype=numpy.float32),
+            "image/object/class/label": [-1, 0, 300, -(1 << 63),
+                                         (1 << 63) - 1],
+            "image/object/class/text": ["machine printed", "é"],
+            "image/object/text": [],
+            "image/object/difficulty": [],
+        }
+        decoded = protobuf.decode_example(protobuf.encode_example(feature))
+        self.assertEqual(set(decoded), set(feature))
+        self.assertEqual(decoded["image/filename"], b"a.png")
+        self.assertEqual(decoded["image/height"], 480)
+        self.assertEqual(decoded["image/width"], 640)
+        self.assertEqual(decoded["image/encoded"], b"\x89PNG\x00\xff")
+        self.assertEqual(decoded["image/object/bbox/xmin"],
+                         [1.5, -2.0, 1e6])
+        self.assertEqual(decoded["image/object/class/label"],
+                         feature["image/object/class/label"])
+        self.assertEqual(decoded["image/object/class/text"],
+                         [b"machine printed", "é".encode("utf-8")])
+        self.assertEqual(decoded["image/object/text"], [])
+        self.assertEqual(decoded["image/object/difficulty"], [])
+
+    def test_none_skipped(self):
+        self.assertEqual(
+            protobuf.decode_example(
+                protobuf.encode_example({
+                    "image/height": 1,
+                    "image/width": None
+                })), {"image/height": 1})
+
+    def test_bytes_values(self):
+        feature = {
+            "image/class/text": numpy.bytes_(b"abc"),
+            "image/object/text": ["é", b"b", bytearray(b"c"), memoryview(b"d")],
+        }
+        decoded = protobuf.decode_example(protobuf.encode_example(feature))
+        self.assertEqual(decoded["image/class/text"], b"abc")
+        self.assertEqual(decoded["image/object/text"],
+                         ["é".encode("utf-8"), b"b", b"c", b"d"])
+        for feature in ({"image/class/text": 3}, {"image/object/text": [1, 2]}):
+            with self.assertRaises(TypeError):
+                protobuf.encode_example(feature)
+
+    def test_unknown_feature(self):
+        with self.assertRaises(NameError):
+            protobuf.encode_example({"image/unknown": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
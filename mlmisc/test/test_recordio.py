@@ -0,0 +1,119 @@
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+from mlmisc.dataset import recordio
+
+
+class CRC32CTest(unittest.TestCase):
+    # RFC 3720 B.4, and the masked values of tensorflow/core/lib/hash/crc32c.h
+    VECTORS = [
+        (b"", 0x00000000, 0xA282EAD8),
+        (b"123456789", 0xE3069283, 0xC78AB0E5),
+        (bytes(32), 0x8A9136AA, 0x0FD7FFFA),
+        (b"\xff" * 32, 0x62A8AB43, 0xF909B029),
+        (bytes(range(32)), 0x46DD794E, 0x951F7892),
+    ]
+
+    def check(self):
+        for data, crc, masked in self.VECTORS:
+            self.assertEqual(recordio.crc32c(data), crc)
+            self.assertEqual(recordio.masked_crc32c(data), masked)
+
+    def test_crc32c(self):
+        self.check()
+
+    def test_crc32c_fallback(self):
+        with mock.patch.object(recordio, "_crc32c", None):
+            self.check()
+
+    def test_frame(self):
+        # written by tensorflow's TFRecordWriter
+        self.assertEqual(
+            recordio.frame(b"hello"),
+            bytes.fromhex("0500000000000000eab2043e68656c6c6fbb1f1c19"))
+
+
+class RecordIOTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        randomizer = random.Random(0)
+        self.records = [
+            bytes(
+                randomizer.getrandbits(8)
+                for _ in range(randomizer.randint(0, 300)))
+            for _ in range(50)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def write(self, compression_type, block_size):
+        filename = os.path.join(self.dirname, "records.tfrecord")
+        with recordio.RecordWriter(
+                filename,
+                compression_type=compression_type,
+                index=True,
+                block_size=block_size) as writer:
+            for number, record in enumerate(self.records):
+                writer.write(record, {"number": number})
+        return filename
+
+    def check_random_access(self, compression_type, block_size):
+        filename = self.write(compression_type, block_size)
+        with recordio.RecordReader(filename) as reader:
+            self.assertEqual(reader.compression_type, compression_type)
+            self.assertEqual(len(reader), len(self.records))
+            self.assertEqual(
+                [entry["number"] for entry in reader.entries],
+                list(range(len(self.records))))
+            self.assertEqual(list(reader), self.records)
+            randomizer = random.Random(1)
+            for _ in range(30):
+                start = randomizer.randrange(len(self.records))
+                stop = randomizer.randrange(start, len(self.records) + 1)
+                self.assertEqual(
+                    reader.read_range(start, stop), self.records[start:stop])
+                self.assertEqual(reader.read(start), self.records[start])
+        return filename
+
+    def test_uncompressed(self):
+        filename = self.check_random_access("", None)
+        with open(filename, "rb") as file:
+            self.assertEqual(file.read(),
+                             b"".join(map(recordio.frame, self.records)))
+
+    def test_gzip_blocks(self):
+        filename = self.check_random_access("GZIP", 7)
+        # the flushed blocks still form a plain gzip stream
+        with gzip.open(filename, "rb") as file:
+            self.assertEqual(file.read(),
+                             b"".join(map(recordio.frame, self.records)))
+
+    def test_zlib_blocks(self):
+        filename = self.check_random_access("ZLIB", 4)
+        with open(filename, "rb") as file:
+            self.assertEqual(
+                zlib.decompress(file.read()),
+                b"".join(map(recordio.frame, self.records)))
+
+    def test_single_block(self):
+        self.check_random_access("GZIP", None)
+
+    def test_corrupted_record(self):
+        filename = self.write("", None)
+        with open(filename, "r+b") as file:
+            file.seek(14)
+            file.write(b"\x00" if self.records[0][2:3] != b"\x00" else b"\x01")
+        with recordio.RecordReader(filename) as reader:
+            with self.assertRaises(IOError):
+                reader.read(0)
+            self.assertEqual(reader.read(1), self.records[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,9 +18,16 @@ __version__ = '1.3'
 
 # The following functions are defined:
 #  getDetections  - Compute TP, FN and FP
+#  getDetectionSweep  - Compute TP, FN and FP counts, recall, precision and f-score for several IoU thresholds
+#  imageTask, detectImage, mapImages  -  per image matching, in parallel processes with workers > 0
+#  matchImage  -  per image matching of a precomputed iouMatrix
 #  evaluateAttribute  - Evaluates accuracy for classifying text attributes
 #  evaluateTranscription  - Evaluates accuracy of transcriptions
-#  area, intersect, iou_score, decode, inter  -  small helper functions
+#  area, intersect, iou_score, decode, boundedDistance, inter  -  small helper functions
+#  bboxArray, iouMatrix  -  vectorized IoU of the boxes of an image
+#  detailedMetrics   - Computes the detailed results as reported in COCO-Text paper
+#  StreamingEvaluator   - Computes the detailed results image by image while the results are produced
+#  getPrecisionRecall   - Computes the precision/recall curves and average precision of scored detections
 #  printDetailedResults   - Prints detailed results as reported in COCO-Text paper
 
 # COCO-Text Evaluation Toolbox.        Version 1.3
@@ -29,17 +36,19 @@ __version__ = '1.3'
 # Licensed under the Simplified BSD License [see bsd.txt]
 
 import editdistance
-import copy
+import multiprocessing
+import numpy as np
 import re
 import sys
 
 # Compute detections
-def getDetections(groundtruth, evaluation, imgIds = None, annIds = [], detection_threshold = 0.5):
+def getDetections(groundtruth, evaluation, imgIds = None, annIds = [], detection_threshold = 0.5, workers = 0):
 	"""
 	A box is a match iff the intersection of union score is >= 0.5.
 	Params
 	------
 	Input dicts have the format of annotation dictionaries
+	workers: number of processes matching the images, 0 to match in this process
 	"""
 	#parameters
 
@@ -49,36 +58,171 @@ def getDetections(groundtruth, evaluation, imgIds = None, annIds = [], detection
 	detectRes['false_negatives'] = []
 	detectRes['false_positives'] = []
 	
+	imgIds = evaluationImgIds(groundtruth, evaluation, imgIds)
+
+	tasks = (imageTask(groundtruth, evaluation, cocoid, detection_threshold) for cocoid in imgIds)
+	for true_positives, false_negatives, false_positives in mapImages(detectImage, tasks, workers):
+		detectRes['true_positives'].extend([{'gt_id': gt_id, 'eval_id': eval_id} for gt_id, eval_id in true_positives])
+		detectRes['false_negatives'].extend([{'gt_id': gt_id} for gt_id in false_negatives])
+		detectRes['false_positives'].extend([{'eval_id': eval_id} for eval_id in false_positives])
+
+	return detectRes
+
+
+SWEEP_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+SWEEP_FIELDS = [('threshold', np.float64), ('true_positives', np.int64), ('false_negatives', np.int64),
+	('false_positives', np.int64), ('recall', np.float64), ('precision', np.float64), ('f_score', np.float64)]
+
+def getDetectionSweep(groundtruth, evaluation, imgIds = None, thresholds = SWEEP_THRESHOLDS, workers = 0):
+	"""
+	Counts TP, FN and FP as getDetections at each IoU threshold in one pass,
+	the IoUs of an image are computed once for all the thresholds.
+	Returns a numpy structured array of SWEEP_FIELDS with a row per threshold,
+	recall, precision and f_score are 0 where undefined.
+	"""
+	thresholds = np.asarray(thresholds, dtype=np.float64).reshape([-1])
+	imgIds = evaluationImgIds(groundtruth, evaluation, imgIds)
+
+	table = np.zeros(len(thresholds), dtype=SWEEP_FIELDS)
+	table['threshold'] = thresholds
+	tasks = (imageTask(groundtruth, evaluation, cocoid, thresholds) for cocoid in imgIds)
+	for true_positives, false_negatives, false_positives in mapImages(sweepImage, tasks, workers):
+		table['true_positives'] += true_positives
+		table['false_negatives'] += false_negatives
+		table['false_positives'] += false_positives
+
+	true_positives = table['true_positives'].astype(np.float64)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		table['recall'] = np.nan_to_num(true_positives / (table['true_positives'] + table['false_negatives']))
+		table['precision'] = np.nan_to_num(true_positives / (table['true_positives'] + table['false_positives']))
+		table['f_score'] = np.nan_to_num(2 * table['recall'] * table['precision'] / (table['recall'] + table['precision']))
+	return table
+
+def evaluationImgIds(groundtruth, evaluation, imgIds = None):
 	# the default is set to evaluate on the validation set
 	if imgIds == None:
 		imgIds = groundtruth.val
 
-	imgIds = imgIds if len(imgIds)>0 else inter(list(groundtruth.imgToAnns.keys()), list(evaluation.imgToAnns.keys()))
-
-	for cocoid in imgIds:
-		gt_bboxes = groundtruth.imgToAnns[cocoid] if cocoid in groundtruth.imgToAnns else []
-		eval_bboxes = copy.copy(evaluation.imgToAnns[cocoid]) if cocoid in evaluation.imgToAnns else []
-
-		for gt_box_id in gt_bboxes:
-			gt_box = groundtruth.anns[gt_box_id]['bbox']
-			max_iou = 0.0
-			match = None
-			for eval_box_id in eval_bboxes:
-				eval_box = evaluation.anns[eval_box_id]['bbox']
-				iou = iou_score(gt_box,eval_box)
-				if iou >= detection_threshold and iou > max_iou:
-					max_iou = iou
-					match = eval_box_id
-			if match is not None:
-				detectRes['true_positives'].append({'gt_id': gt_box_id, 'eval_id': match})
-				eval_bboxes.remove(match)
-			else:
-				detectRes['false_negatives'].append({'gt_id': gt_box_id})
-		if len(eval_bboxes)>0:
-			detectRes['false_positives'].extend([{'eval_id': eval_box_id} for eval_box_id in eval_bboxes])
+	return imgIds if len(imgIds)>0 else inter(list(groundtruth.imgToAnns.keys()), list(evaluation.imgToAnns.keys()))
 
-	return detectRes
+def imageTask(groundtruth, evaluation, cocoid, detection_threshold, transcriptions = False):
+	"""
+	The compact arrays of an image needed by detectImage:
+	(gt ids, gt boxes, eval ids, eval boxes, detection_threshold, gt strings, eval strings),
+	the strings are None unless transcriptions is set, the string of an ann without utf8_string is None.
+	"""
+	gt_ids = groundtruth.imgToAnns[cocoid] if cocoid in groundtruth.imgToAnns else []
+	eval_ids = evaluation.imgToAnns[cocoid] if cocoid in evaluation.imgToAnns else []
+	gt_anns = [groundtruth.anns[gt_id] for gt_id in gt_ids]
+	eval_anns = [evaluation.anns[eval_id] for eval_id in eval_ids]
+	gt_strings = eval_strings = None
+	if transcriptions:
+		gt_strings = [ann.get('utf8_string') for ann in gt_anns]
+		eval_strings = [ann.get('utf8_string') for ann in eval_anns]
+	return (list(gt_ids), bboxArray(gt_anns), list(eval_ids), bboxArray(eval_anns),
+		detection_threshold, gt_strings, eval_strings)
+
+def detectImage(task):
+	"""
+	Matches the boxes of an image, task is given by imageTask.
+	The eval boxes are matched greedily in the order of the gt boxes, each gt box takes
+	the first remaining eval box with the highest IoU. With the strings, the gt boxes
+	without utf8_string are skipped, and the remaining eval boxes are scanned in order:
+	a box is taken whenever its IoU beats the best so far, and the scan stops at such
+	a box with the exact text.
+	Returns (true positive (gt_id, eval_id) pairs, false negative gt ids, false positive eval ids)
+	"""
+	gt_ids, gt_boxes, eval_ids, eval_boxes, detection_threshold, gt_strings, eval_strings = task
+	return matchImage(gt_ids, eval_ids, iouMatrix(gt_boxes, eval_boxes), detection_threshold, gt_strings, eval_strings)
 
+def matchImage(gt_ids, eval_ids, ious, detection_threshold, gt_strings = None, eval_strings = None):
+	"""
+	Matches the boxes of an image as detectImage, given their iouMatrix, which is not changed.
+	"""
+	if gt_strings is None:
+		matches = greedyMatch(ious, detection_threshold)
+		matched = matches >= 0
+		true_positives = [(gt_ids[row], eval_ids[match]) for row, match in enumerate(matches.tolist()) if match >= 0]
+		false_negatives = [gt_ids[row] for row in np.flatnonzero(~matched)]
+		available = np.ones(len(eval_ids), dtype=bool)
+		available[matches[matched]] = False
+		return true_positives, false_negatives, [eval_ids[index] for index in np.flatnonzero(available)]
+
+	ious = ious.copy()
+	ious[ious < detection_threshold] = 0.0
+	available = np.ones(len(eval_ids), dtype=bool)
+	true_positives = []
+	false_negatives = []
+	# the eval strings are decoded once, when first compared
+	eval_vals = {}
+	for row, gt_id in enumerate(gt_ids):
+		if gt_strings[row] is None:
+			continue
+		candidates = np.flatnonzero(available & (ious[row] > 0.0))
+		values = ious[row, candidates]
+		best = np.maximum.accumulate(np.concatenate([[0.0], values[:-1]]))
+		gt_val = decode(gt_strings[row]) if len(candidates) else None
+		match = None
+		for index in candidates[values > best].tolist():
+			match = index
+			if eval_strings[match] is not None:
+				if match not in eval_vals:
+					eval_vals[match] = decode(eval_strings[match])
+				if eval_vals[match] == gt_val:
+					break
+		if match is not None:
+			true_positives.append((gt_id, eval_ids[match]))
+			available[match] = False
+		else:
+			false_negatives.append(gt_id)
+	false_positives = [eval_ids[index] for index in np.flatnonzero(available)]
+	return true_positives, false_negatives, false_positives
+
+def greedyMatch(ious, detection_threshold):
+	"""
+	Matches greedily the eval boxes (columns) to the gt boxes (rows) in order, each gt box
+	takes the first remaining eval box with the highest IoU >= detection_threshold.
+	Returns the column matched by each row, -1 if none.
+	"""
+	ious = np.where(ious >= detection_threshold, ious, 0.0)
+	matches = np.full(len(ious), -1, dtype=np.int64)
+	if not ious.size:
+		return matches
+	for row in range(len(ious)):
+		match = int(np.argmax(ious[row]))
+		if ious[row, match] > 0.0:
+			matches[row] = match
+			ious[:, match] = 0.0
+	return matches
+
+def sweepImage(task):
+	"""
+	Matches the boxes of an image at each threshold, task is given by imageTask
+	with the list of thresholds as detection_threshold.
+	Returns the arrays of the true positive, false negative and false positive counts
+	"""
+	gt_ids, gt_boxes, eval_ids, eval_boxes, thresholds = task[:5]
+	ious = iouMatrix(gt_boxes, eval_boxes)
+	true_positives = np.array([np.count_nonzero(greedyMatch(ious, threshold) >= 0) for threshold in thresholds],
+		dtype=np.int64)
+	return true_positives, len(gt_ids) - true_positives, len(eval_ids) - true_positives
+
+def mapImages(function, tasks, workers = 0, chunksize = 16):
+	"""
+	Yields function(task) for the tasks in order, computed by a pool
+	of workers processes if workers > 0.
+	"""
+	if not workers:
+		for task in tasks:
+			yield function(task)
+		return
+	pool = multiprocessing.Pool(workers)
+	try:
+		for result in pool.imap(function, tasks, chunksize):
+			yield result
+	finally:
+		pool.terminate()
+		pool.join()
 
 def evaluateAttribute(groundtruth, evaluation, resultDict, attributes):
 	'''
@@ -106,12 +250,15 @@ def evaluateAttribute(groundtruth, evaluation, resultDict, attributes):
 		res[attribute] = {'attribute': attribute, 'correct':len(correct), 'incorrect':len(incorrect), 'accuracy':len(correct)*1.0/len(correct+incorrect)}
 	return res
 
-def evaluateEndToEnd(groundtruth, evaluation, imgIds = None, annIds = [], detection_threshold = 0.5):
+TRANSCRIPTION_SETTINGS = [('exact', 0), ('distance1', 1)]
+
+def evaluateEndToEnd(groundtruth, evaluation, imgIds = None, annIds = [], detection_threshold = 0.5, workers = 0):
 	"""
 	A box is a match iff the intersection of union score is >= 0.5.
 	Params
 	------
 	Input dicts have the format of annotation dictionaries
+	workers: number of processes matching the images, 0 to match in this process
 	"""
 	#parameters
 
@@ -121,71 +268,37 @@ def evaluateEndToEnd(groundtruth, evaluation, imgIds = None, annIds = [], detect
 	detectRes['false_negatives'] = []
 	detectRes['false_positives'] = []
 	
-	# the default is set to evaluate on the validation set
-	if imgIds == None:
-		imgIds = groundtruth.val
-
-	imgIds = imgIds if len(imgIds)>0 else inter(list(groundtruth.imgToAnns.keys()), list(evaluation.imgToAnns.keys()))
+	imgIds = evaluationImgIds(groundtruth, evaluation, imgIds)
 
-	for cocoid in imgIds:
-		gt_bboxes = groundtruth.imgToAnns[cocoid] if cocoid in groundtruth.imgToAnns else []
-		eval_bboxes = copy.copy(evaluation.imgToAnns[cocoid]) if cocoid in evaluation.imgToAnns else []
-
-		for gt_box_id in gt_bboxes:
-
-			gt_box = groundtruth.anns[gt_box_id]['bbox']
-			if 'utf8_string' not in groundtruth.anns[gt_box_id]:
-				continue
-			gt_val = decode(groundtruth.anns[gt_box_id]['utf8_string'])
-
-			max_iou = 0.0
-
-			match = None
-			for eval_box_id in eval_bboxes:
-				eval_box = evaluation.anns[eval_box_id]['bbox']
-				iou = iou_score(gt_box,eval_box)
-
-				if iou >=detection_threshold and iou > max_iou:
-					max_iou = iou
-					match = eval_box_id
-					if 'utf8_string' in evaluation.anns[eval_box_id]:
-						eval_val = decode(evaluation.anns[eval_box_id]['utf8_string'])
-						if editdistance.eval(gt_val, eval_val)==0:
-							break
-			if match is not None:
-				detectRes['true_positives'].append({'gt_id': gt_box_id, 'eval_id': match})
-				eval_bboxes.remove(match)
-			else:
-				detectRes['false_negatives'].append({'gt_id': gt_box_id})
-		if len(eval_bboxes)>0:
-			detectRes['false_positives'].extend([{'eval_id': eval_box_id} for eval_box_id in eval_bboxes])
+	tasks = (imageTask(groundtruth, evaluation, cocoid, detection_threshold, True) for cocoid in imgIds)
+	for true_positives, false_negatives, false_positives in mapImages(detectImage, tasks, workers):
+		detectRes['true_positives'].extend([{'gt_id': gt_id, 'eval_id': eval_id} for gt_id, eval_id in true_positives])
+		detectRes['false_negatives'].extend([{'gt_id': gt_id} for gt_id in false_negatives])
+		detectRes['false_positives'].extend([{'eval_id': eval_id} for eval_id in false_positives])
 
 	resultDict = detectRes
 
+	# the edit distance of a pair is computed once for all the settings, bounded by the largest threshold
+	settings = TRANSCRIPTION_SETTINGS
+	bound = max(threshold for setting, threshold in settings)
+	distances = []
+	for detection in resultDict['true_positives']:
+		status, distance, gt_val, eval_val = transcriptionStatus(groundtruth.anns[detection['gt_id']].get('utf8_string'),
+			evaluation.anns[detection['eval_id']].get('utf8_string'), bound)
+		if status == 'scored':
+			detection['gt_string'] = gt_val
+			detection['eval_string'] = eval_val
+		distances.append((detection, status, distance))
+
 	res = {}
-	for setting, threshold in zip(['exact', 'distance1'],[0,1]):
+	for setting, threshold in settings:
 		correct = []
 		incorrect = []
 		ignore = []
-		for detection in resultDict['true_positives']:
-			if 'utf8_string' not in groundtruth.anns[detection['gt_id']]:
-				ignore.append(detection)
-				continue
-
-			gt_val = decode(groundtruth.anns[detection['gt_id']]['utf8_string'])
-			if len(gt_val)<3:
+		for detection, status, distance in distances:
+			if status == 'ignore':
 				ignore.append(detection)
-				continue
-
-			if 'utf8_string' not in evaluation.anns[detection['eval_id']]:
-				incorrect.append(detection)
-				continue
-
-			eval_val = decode(evaluation.anns[detection['eval_id']]['utf8_string'])
-
-			detection['gt_string'] = gt_val
-			detection['eval_string'] = eval_val
-			if editdistance.eval(gt_val, eval_val)<=threshold:
+			elif status == 'scored' and distance<=threshold:
 				correct.append(detection)
 			else:
 				incorrect.append(detection)
@@ -193,6 +306,23 @@ def evaluateEndToEnd(groundtruth, evaluation, imgIds = None, annIds = [], detect
 		res[setting] = {'setting': setting, 'correct':correct, 'incorrect':incorrect, 'ignore':ignore, 'accuracy':len(correct)*1.0/len(correct+incorrect)}
 	return res
 
+def transcriptionStatus(gt_string, eval_string, bound):
+	"""
+	Scores the transcription of a matched pair, the strings are None if absent.
+	Returns (status, distance, decoded gt string, decoded eval string), status is 'ignore'
+	if the gt has no string or less than 3 characters, 'incorrect' if the eval has no string,
+	'scored' otherwise, with the boundedDistance of the decoded strings.
+	"""
+	if gt_string is None:
+		return 'ignore', None, None, None
+	gt_val = decode(gt_string)
+	if len(gt_val)<3:
+		return 'ignore', None, gt_val, None
+	if eval_string is None:
+		return 'incorrect', None, gt_val, None
+	eval_val = decode(eval_string)
+	return 'scored', boundedDistance(gt_val, eval_val, bound), gt_val, eval_val
+
 def area(bbox):
 	return bbox[2] * 1.0 * bbox[3] # width * height
 
@@ -223,120 +353,384 @@ def iou_score(bboxA, bboxB):
 	else:
 		return 0
 
+def bboxArray(anns):
+	"""Returns the [x, y, width, height] boxes of the anns as a (n, 4) array
+	"""
+	return np.array([ann['bbox'] for ann in anns], dtype=np.float64).reshape([-1, 4])
+
+def iouMatrix(bboxesA, bboxesB):
+	"""Returns the matrix of the iou_score of each box of bboxesA
+	against each box of bboxesB, both given as (n, 4) arrays.
+	"""
+	a = bboxesA[:, None, :]
+	b = bboxesB[None, :, :]
+	new_top = np.maximum(a[..., 1], b[..., 1])
+	new_left = np.maximum(a[..., 0], b[..., 0])
+	new_right = np.minimum(a[..., 0]+a[..., 2], b[..., 0]+b[..., 2])
+	new_bottom = np.minimum(a[..., 1]+a[..., 3], b[..., 1]+b[..., 3])
+	overlap = (new_top < new_bottom) & (new_left < new_right)
+	intersection_area = np.where(overlap, (new_right - new_left) * (new_bottom - new_top), 0.0)
+	union_area = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - intersection_area
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return np.where(union_area > 0, intersection_area / union_area, 0.0)
+
+DECODE_PATTERN = re.compile('[^a-zA-Z0-9!?@\_\-\+\*\:\&\/ \.]')
+
 def decode(trans):
 	if sys.version[0] == '2':
 		trans = trans.encode("ascii" ,'ignore')
 	
 	trans = trans.replace('\n', ' ')
-	trans2 = re.sub('[^a-zA-Z0-9!?@\_\-\+\*\:\&\/ \.]', '', trans)
+	trans2 = DECODE_PATTERN.sub('', trans)
 	return trans2.lower()
 
+def boundedDistance(a, b, bound):
+	"""Returns the edit distance of the strings if it is <= bound, bound + 1 otherwise.
+	The common bound <= 1 case is decided with a single scan of the strings.
+	"""
+	if a == b:
+		return 0
+	if bound < 1 or abs(len(a) - len(b)) > bound:
+		return bound + 1
+	if bound > 1:
+		return min(editdistance.eval(a, b), bound + 1)
+	# a single substitution, insertion or deletion after the common prefix
+	if len(a) < len(b):
+		a, b = b, a
+	prefix = 0
+	while prefix < len(b) and a[prefix] == b[prefix]:
+		prefix += 1
+	if len(a) == len(b):
+		return 1 if a[prefix + 1:] == b[prefix + 1:] else 2
+	return 1 if a[prefix + 1:] == b[prefix:] else 2
+
 def inter(list1, list2):
 	return list(set(list1).intersection(set(list2)))
 
+RECALL_BUCKETS = [
+	('legible & machine printed', [('legibility', 'legible'), ('class', 'machine printed')]),
+	('legible & handwritten', [('legibility', 'legible'), ('class', 'handwritten')]),
+	('legible & others', [('legibility', 'legible'), ('class', 'others')]),
+	('legible overall', [('legibility', 'legible'), ('class', ('machine printed', 'handwritten'))]),
+	('illegible & machine printed', [('legibility', 'illegible'), ('class', 'machine printed')]),
+	('illegible & handwritten', [('legibility', 'illegible'), ('class', 'handwritten')]),
+	('illegible & others', [('legibility', 'illegible'), ('class', 'others')]),
+	('illegible overall', [('legibility', 'illegible'), ('class', ('machine printed', 'handwritten'))]),
+]
+END_TO_END_BUCKET = [('legibility', 'legible'), ('language', 'english'), ('class', ('machine printed', 'handwritten'))]
+TOTAL_BUCKET = [('legibility', ('legible', 'illegible')), ('class', ('machine printed', 'handwritten'))]
+BUCKETS = RECALL_BUCKETS + [('total', TOTAL_BUCKET), ('end_to_end', END_TO_END_BUCKET)]
+
+def attributeTable(c_text, attributes = ('legibility', 'class', 'language')):
+	"""
+	Columnar table of the ann attributes of the groundtruth.
+	Returns (sorted ann ids, dict attribute -> object array of the values, None where absent)
+	"""
+	ids = np.array(sorted(c_text.anns), dtype=np.int64)
+	columns = {}
+	for attribute in attributes:
+		values = np.full(len(ids), None, dtype=object)
+		index = c_text.attributeIndex(attribute)
+		if index is None:
+			values[:] = [c_text.anns[annid].get(attribute) for annid in ids.tolist()]
+		else:
+			for value, annids in index.items():
+				values[np.searchsorted(ids, annids)] = value
+		columns[attribute] = values
+	return ids, columns
+
+def bucketMask(columns, bucket):
+	"""
+	Mask of the rows of an attributeTable matching all the (attribute, value or tuple of values) of bucket
+	"""
+	mask = np.ones(len(next(iter(columns.values()))), dtype=bool)
+	for attribute, values in bucket:
+		values = values if isinstance(values, tuple) else (values,)
+		mask &= np.isin(columns[attribute], list(values))
+	return mask
+
+def bucketMasks(columns):
+	"""
+	Masks of the rows of an attributeTable in each of the BUCKETS, as a (buckets, rows) array
+	"""
+	return np.array([bucketMask(columns, bucket) for name, bucket in BUCKETS], dtype=bool).reshape([len(BUCKETS), -1])
+
+def detailedMetrics(c_text, detection_results, transcription_results, table = None):
+	"""
+	The metrics reported in the COCO-Text paper, as percentages.
+	table: attributeTable(c_text), built if not given
+	Returns a dict:
+		'recall': dict recall bucket name -> recall, None for the empty buckets
+		'total_recall', 'precision', 'f_score': localization, f_score is None if undefined
+		'exact', 'distance1': transcription accuracies
+		'end_to_end_recall', 'end_to_end_precision', 'end_to_end_f_score': end-to-end, f_score is None if undefined
+	"""
+	ids, columns = table if table is not None else attributeTable(c_text)
+	masks = bucketMasks(columns)
+	found = np.isin(ids, [x['gt_id'] for x in detection_results['true_positives']])
+	n_found = np.isin(ids, [x['gt_id'] for x in detection_results['false_negatives']])
+	found_counts = dict(zip([name for name, bucket in BUCKETS], np.count_nonzero(masks & found, axis=1).tolist()))
+	evaluated_counts = dict(zip([name for name, bucket in BUCKETS], np.count_nonzero(masks & (found | n_found), axis=1).tolist()))
+	return countMetrics(found_counts, evaluated_counts, len(detection_results['true_positives']),
+		len(detection_results['false_positives']),
+		{setting: transcription_results[setting]['accuracy'] for setting, threshold in TRANSCRIPTION_SETTINGS})
+
+def countMetrics(found, evaluated, n_true_positives, n_false_positives, accuracies):
+	"""
+	The metrics of detailedMetrics from the counts of the gt boxes.
+	found, evaluated: dict bucket name -> number of the gt boxes of the bucket that are found,
+		that are found or not found
+	n_true_positives, n_false_positives: number of the true and false positive detections
+	accuracies: dict transcription setting -> accuracy
+	"""
+	metrics = {'recall': {}}
+	for name, bucket in RECALL_BUCKETS:
+		metrics['recall'][name] = 100*found[name]*1.0/evaluated[name] if evaluated[name]>0 else None
+
+	t_recall = 100*n_true_positives*1.0/evaluated['total']
+	t_precision = 100*n_true_positives*1.0/(n_true_positives + n_false_positives)
+	metrics['total_recall'] = t_recall
+	metrics['precision'] = t_precision
+	metrics['f_score'] = 2 * t_recall * t_precision / (t_recall + t_precision) if (t_recall + t_precision)>0 else None
+
+	metrics['exact'] = 100*accuracies['exact']
+	metrics['distance1'] = 100*accuracies['distance1']
+
+	accuracy = accuracies['exact']
+	n_found_e2e = found['end_to_end']
+	TP_new = n_found_e2e * accuracy
+	FP_new = n_false_positives + n_found_e2e*(1-accuracy)
+	FN_new = (evaluated['end_to_end'] - n_found_e2e) + n_found_e2e*(1-accuracy)
+	t_recall_new = 100 * TP_new / (TP_new + FN_new)
+	t_precision_new = 100 * TP_new / (TP_new + FP_new) if (TP_new + FP_new)>0 else 0
+	metrics['end_to_end_recall'] = t_recall_new
+	metrics['end_to_end_precision'] = t_precision_new
+	metrics['end_to_end_f_score'] = (2 * t_recall_new * t_precision_new / (t_recall_new + t_precision_new)
+		if (t_recall_new + t_precision_new)>0 else None)
+	return metrics
+
+class StreamingEvaluator(object):
+	"""
+	Evaluates the results image by image while they are produced.
+	An image is matched as by getDetections and evaluateEndToEnd when it is given to update,
+	only the counters of the metrics are kept. Each evaluated image must be given once, with
+	no boxes if nothing is detected, the images never given are not evaluated.
+	"""
+
+	def __init__(self, groundtruth, detection_threshold = 0.5, table = None):
+		"""
+		groundtruth: COCO_Text
+		table: attributeTable(groundtruth), built if not given
+		"""
+		self.groundtruth = groundtruth
+		self.detection_threshold = detection_threshold
+		self.ids, columns = table if table is not None else attributeTable(groundtruth)
+		self.masks = bucketMasks(columns)
+		self.found = np.zeros(len(BUCKETS), dtype=np.int64)
+		self.evaluated = np.zeros(len(BUCKETS), dtype=np.int64)
+		self.true_positives = 0
+		self.false_positives = 0
+		self.correct = dict((setting, 0) for setting, threshold in TRANSCRIPTION_SETTINGS)
+		self.incorrect = dict((setting, 0) for setting, threshold in TRANSCRIPTION_SETTINGS)
+		self.imgIds = set()
+
+	def update(self, image_id, boxes, texts = None, scores = None):
+		"""
+		image_id: cocoid of the image
+		boxes: [x, y, width, height] of the detections
+		texts: utf8 strings of the detections, None for the detections without
+		scores: confidences of the detections, not used by the metrics
+		"""
+		if image_id in self.imgIds:
+			raise ValueError('image {} is already evaluated'.format(image_id))
+		self.imgIds.add(image_id)
+
+		groundtruth = self.groundtruth
+		gt_ids = groundtruth.imgToAnns[image_id] if image_id in groundtruth.imgToAnns else []
+		gt_anns = [groundtruth.anns[gt_id] for gt_id in gt_ids]
+		gt_boxes = bboxArray(gt_anns)
+		boxes = np.asarray(boxes, dtype=np.float64).reshape([-1, 4])
+		eval_ids = list(range(len(boxes)))
+		texts = list(texts) if texts is not None else [None] * len(boxes)
+
+		# the IoU of the boxes is shared by the detection and the end to end matching
+		ious = iouMatrix(gt_boxes, boxes)
+		true_positives, false_negatives, false_positives = matchImage(
+			gt_ids, eval_ids, ious, self.detection_threshold)
+		found = np.searchsorted(self.ids, [gt_id for gt_id, eval_id in true_positives]).astype(np.int64)
+		n_found = np.searchsorted(self.ids, false_negatives).astype(np.int64)
+		self.found += np.count_nonzero(self.masks[:, found], axis=1)
+		self.evaluated += np.count_nonzero(self.masks[:, found], axis=1) + np.count_nonzero(self.masks[:, n_found], axis=1)
+		self.true_positives += len(true_positives)
+		self.false_positives += len(false_positives)
+
+		gt_strings = [ann.get('utf8_string') for ann in gt_anns]
+		matches = matchImage(gt_ids, eval_ids, ious, self.detection_threshold, gt_strings, texts)[0]
+		gt_strings = dict(zip(gt_ids, gt_strings))
+		bound = max(threshold for setting, threshold in TRANSCRIPTION_SETTINGS)
+		for gt_id, index in matches:
+			status, distance, gt_val, eval_val = transcriptionStatus(gt_strings[gt_id], texts[index], bound)
+			if status == 'ignore':
+				continue
+			for setting, threshold in TRANSCRIPTION_SETTINGS:
+				if status == 'scored' and distance<=threshold:
+					self.correct[setting] += 1
+				else:
+					self.incorrect[setting] += 1
+
+	def summarize(self):
+		"""
+		Returns the metrics of the images given so far, as detailedMetrics
+		"""
+		names = [name for name, bucket in BUCKETS]
+		accuracies = dict((setting, self.correct[setting]*1.0/(self.correct[setting] + self.incorrect[setting]))
+			for setting, threshold in TRANSCRIPTION_SETTINGS)
+		return countMetrics(dict(zip(names, self.found.tolist())), dict(zip(names, self.evaluated.tolist())),
+			self.true_positives, self.false_positives, accuracies)
+
+def getPrecisionRecall(groundtruth, evaluation, imgIds = None, thresholds = SWEEP_THRESHOLDS, table = None, workers = 0):
+	"""
+	Precision/recall curves and average precision of the scored detections for each
+	IoU threshold and each of the BUCKETS of gt boxes.
+	In each image, the detections are matched in the order of their scores to the remaining
+	gt box with the highest IoU >= threshold. For a bucket, a detection matched to a gt box
+	of the bucket is a true positive, a detection matched to another gt box is ignored and
+	an unmatched detection is a false positive. The detections of all the images are then
+	sorted by score to accumulate the true and false positives.
+	table: attributeTable(groundtruth), built if not given
+	Returns a dict:
+		'thresholds': the IoU thresholds, 'categories': the bucket names
+		'ap': (thresholds, categories) array of the average precisions, nan for an empty bucket
+		'recall', 'precision', 'scores': [threshold][category] arrays of the curves
+	"""
+	thresholds = np.asarray(thresholds, dtype=np.float64).reshape([-1])
+	imgIds = evaluationImgIds(groundtruth, evaluation, imgIds)
+	ids, columns = table if table is not None else attributeTable(groundtruth)
+	masks = bucketMasks(columns)
+
+	tasks = (scoredImageTask(groundtruth, evaluation, cocoid, thresholds, ids) for cocoid in imgIds)
+	positives = np.zeros(len(BUCKETS), dtype=np.int64)
+	scores = []
+	matches = []
+	for gt_rows, image_scores, image_matches in mapImages(matchScoredImage, tasks, workers):
+		positives += np.count_nonzero(masks[:, gt_rows], axis=1)
+		scores.append(image_scores)
+		matches.append(image_matches)
+	scores = np.concatenate(scores) if scores else np.zeros(0)
+	matches = np.concatenate(matches, axis=1) if matches else np.zeros([len(thresholds), 0], dtype=np.int64)
+
+	order = np.argsort(-scores, kind='stable')
+	scores = scores[order]
+	matches = matches[:, order]
+	res = {'thresholds': thresholds, 'categories': [name for name, bucket in BUCKETS],
+		'ap': np.full([len(thresholds), len(BUCKETS)], np.nan), 'recall': [], 'precision': [], 'scores': []}
+	for t in range(len(thresholds)):
+		matched = matches[t] >= 0
+		in_bucket = np.zeros([len(BUCKETS), len(scores)], dtype=bool)
+		in_bucket[:, matched] = masks[:, matches[t][matched]]
+		res['recall'].append([])
+		res['precision'].append([])
+		res['scores'].append([])
+		for c in range(len(BUCKETS)):
+			kept = in_bucket[c] | ~matched
+			true_positives = np.cumsum(in_bucket[c][kept])
+			false_positives = np.cumsum(~matched[kept])
+			recall = true_positives * 1.0 / positives[c] if positives[c] > 0 else np.zeros(len(true_positives))
+			precision = true_positives * 1.0 / np.maximum(true_positives + false_positives, 1)
+			res['recall'][t].append(recall)
+			res['precision'][t].append(precision)
+			res['scores'][t].append(scores[kept])
+			if positives[c] > 0:
+				res['ap'][t, c] = averagePrecision(recall, precision)
+	return res
+
+def scoredImageTask(groundtruth, evaluation, cocoid, thresholds, ids):
+	"""
+	The compact arrays of an image needed by matchScoredImage:
+	(gt rows in the sorted ann ids, gt boxes, eval scores, eval boxes, thresholds)
+	"""
+	gt_ids = groundtruth.imgToAnns[cocoid] if cocoid in groundtruth.imgToAnns else []
+	eval_ids = evaluation.imgToAnns[cocoid] if cocoid in evaluation.imgToAnns else []
+	eval_anns = [evaluation.anns[eval_id] for eval_id in eval_ids]
+	return (np.searchsorted(ids, gt_ids).astype(np.int64), bboxArray([groundtruth.anns[gt_id] for gt_id in gt_ids]),
+		np.array([ann['score'] for ann in eval_anns], dtype=np.float64), bboxArray(eval_anns), thresholds)
+
+def matchScoredImage(task):
+	"""
+	Matches the detections of an image in the order of their scores, task is given by scoredImageTask.
+	Returns (gt rows, eval scores, (thresholds, detections) array of the matched gt rows, -1 if none)
+	"""
+	gt_rows, gt_boxes, scores, eval_boxes, thresholds = task
+	ious = iouMatrix(gt_boxes, eval_boxes)
+	order = np.argsort(-scores, kind='stable')
+	matches = np.full([len(thresholds), len(scores)], -1, dtype=np.int64)
+	if len(gt_rows):
+		for t, threshold in enumerate(thresholds):
+			# the columns of the detections in score order, matched as the rows by greedyMatch
+			columns = greedyMatch(ious[:, order].T, threshold)
+			matched = columns >= 0
+			matches[t, order[matched]] = gt_rows[columns[matched]]
+	return gt_rows, scores, matches
+
+def averagePrecision(recall, precision):
+	"""
+	Area under the precision/recall curve, with the precision made non increasing
+	"""
+	recall = np.concatenate([[0.0], recall, [1.0]])
+	precision = np.concatenate([[0.0], precision, [0.0]])
+	precision = np.maximum.accumulate(precision[::-1])[::-1]
+	steps = np.flatnonzero(recall[1:] != recall[:-1])
+	return float(np.sum((recall[steps + 1] - recall[steps]) * precision[steps + 1]))
+
 def printDetailedResults(c_text, detection_results, transcription_results, name):
 	print(name)
-	#detected coco-text annids
-	found = [x['gt_id'] for x in detection_results['true_positives']]
-	n_found = [x['gt_id'] for x in detection_results['false_negatives']]
-	fp = [x['eval_id'] for x in detection_results['false_positives']]
-
-	leg_eng_mp = c_text.getAnnIds(imgIds=[], catIds=[('legibility','legible'),('language','english'),('class','machine printed')], areaRng=[])
-	leg_eng_hw = c_text.getAnnIds(imgIds=[], catIds=[('legibility','legible'),('language','english'),('class','handwritten')], areaRng=[])
-	leg_mp  = c_text.getAnnIds(imgIds=[], catIds=[('legibility','legible'),('class','machine printed')], areaRng=[])
-	ileg_mp = c_text.getAnnIds(imgIds=[], catIds=[('legibility','illegible'),('class','machine printed')], areaRng=[])
-	leg_hw  = c_text.getAnnIds(imgIds=[], catIds=[('legibility','legible'),('class','handwritten')], areaRng=[])
-	ileg_hw = c_text.getAnnIds(imgIds=[], catIds=[('legibility','illegible'),('class','handwritten')], areaRng=[])
-	leg_ot  = c_text.getAnnIds(imgIds=[], catIds=[('legibility','legible'),('class','others')], areaRng=[])
-	ileg_ot = c_text.getAnnIds(imgIds=[], catIds=[('legibility','illegible'),('class','others')], areaRng=[])
+	metrics = detailedMetrics(c_text, detection_results, transcription_results)
+
+	def percentage(value, format = "%.2f"):
+		return format%(value) if value is not None else 0
+
+	recall = {bucket: percentage(value) for bucket, value in metrics['recall'].items()}
+	lm = recall['legible & machine printed']
+	lh = recall['legible & handwritten']
+	ilm = recall['illegible & machine printed']
+	ilh = recall['illegible & handwritten']
 
 	#Detection 
 	print() 
 	print("Detection")
 	print("Recall")
-
-	if (len(inter(found+n_found, leg_mp)))>0:
-		lm = "%.2f"%(100*len(inter(found, leg_mp))*1.0/(len(inter(found+n_found, leg_mp))))
-	else:
-		lm = 0
 	print('legible & machine printed: ', lm) 
-
-	if (len(inter(found+n_found, leg_hw)))>0:
-		lh = "%.2f"%(100*len(inter(found, leg_hw))*1.0/(len(inter(found+n_found, leg_hw))))
-	else:
-		lh = 0
 	print('legible & handwritten: ', lh) 
-
-	if (len(inter(found+n_found, leg_ot)))>0:
-		lo = "%.2f"%(100*len(inter(found, leg_ot))*1.0/(len(inter(found+n_found, leg_ot))))
-	else:
-		lo = 0
-	# print 'legible & others: ', lo
-
-	if (len(inter(found+n_found, leg_mp+leg_hw)))>0:
-		lto = "%.2f"%(100*len(inter(found, leg_mp+leg_hw))*1.0/(len(inter(found+n_found, leg_mp+leg_hw))))
-	else:
-		lto = 0
-	print('legible overall: ', lto)  
-
-	if (len(inter(found+n_found, ileg_mp)))>0:
-		ilm = "%.2f"%(100*len(inter(found, ileg_mp))*1.0/(len(inter(found+n_found, ileg_mp))))
-	else:
-		ilm = 0
+	# print 'legible & others: ', recall['legible & others']
+	print('legible overall: ', recall['legible overall'])  
 	print('illegible & machine printed: ', ilm) 
-
-	if (len(inter(found+n_found, ileg_hw)))>0:
-		ilh = "%.2f"%(100*len(inter(found, ileg_hw))*1.0/(len(inter(found+n_found, ileg_hw))))
-	else:
-		ilh = 0
 	print('illegible & handwritten: ', ilh) 
+	# print 'illegible & others: ', recall['illegible & others']
+	print('illegible overall: ', recall['illegible overall']) 
 
-	if (len(inter(found+n_found, ileg_ot)))>0:
-		ilo = "%.2f"%(100*len(inter(found, ileg_ot))*1.0/(len(inter(found+n_found, ileg_ot))))
-	else:
-		ilo = 0
-	# print 'illegible & others: ', ilo 
-
-	if (len(inter(found+n_found, ileg_mp+ileg_hw)))>0:
-		ilto = "%.2f"%(100*len(inter(found, ileg_mp+ileg_hw))*1.0/(len(inter(found+n_found, ileg_mp+ileg_hw))))
-	else:
-		ilto = 0
-	print('illegible overall: ', ilto) 
-
-	#total = "%.1f"%(100*len(found)*1.0/(len(found)+len(n_found)))
-	t_recall = 100*len(found)*1.0/(len(inter(found+n_found, leg_mp+leg_hw+ileg_mp+ileg_hw)))
-	total = "%.1f"%(t_recall)
+	total = percentage(metrics['total_recall'], "%.1f")
 	print('total recall: ', total)
 
 	print("Precision")
-
-	t_precision = 100*len(found)*1.0/(len(found+fp))
-	precision = "%.2f"%(t_precision)
+	precision = percentage(metrics['precision'])
 	print('total precision: ', precision)
 
 	print("f-score")
-
-	f_score = "%.2f"%(2 * t_recall * t_precision / (t_recall + t_precision)) if (t_recall + t_precision)>0 else 0
+	f_score = percentage(metrics['f_score'])
 	print('f-score localization: ', f_score)
 
 	print() 
 	print("Transcription")
-	transAcc = "%.2f"%(100*transcription_results['exact']['accuracy'])
-	transAcc1 = "%.2f"%(100*transcription_results['distance1']['accuracy'])
+	transAcc = percentage(metrics['exact'])
+	transAcc1 = percentage(metrics['distance1'])
 	print('accuracy for exact matches: ', transAcc)
 	print('accuracy for matches with edit distance<=1: ', transAcc1)
 
 	print()
 	print('End-to-end')
-	TP_new = len(inter(found, leg_eng_mp+leg_eng_hw)) * transcription_results['exact']['accuracy']
-	FP_new = len(fp) + len(inter(found, leg_eng_mp+leg_eng_hw))*(1-transcription_results['exact']['accuracy'])
-	FN_new = len(inter(n_found, leg_eng_mp+leg_eng_hw)) + len(inter(found, leg_eng_mp+leg_eng_hw))*(1-transcription_results['exact']['accuracy'])
-	t_recall_new = 100 * TP_new / (TP_new + FN_new)
-	t_precision_new = 100 * TP_new / (TP_new + FP_new) if (TP_new + FP_new)>0 else 0
-	fscore = "%.2f"%(2 * t_recall_new * t_precision_new / (t_recall_new + t_precision_new)) if (t_recall_new + t_precision_new)>0 else 0
-
-	recall_new = "%.2f"%(t_recall_new)
-	precision_new = "%.2f"%(t_precision_new)
+	recall_new = percentage(metrics['end_to_end_recall'])
+	precision_new = percentage(metrics['end_to_end_precision'])
+	fscore = percentage(metrics['end_to_end_f_score'])
 	print('recall: ', recall_new, end=' ') 
 	print('precision: ', precision_new)
 	print('End-to-end f-score: ', fscore)
@@ -47,12 +47,263 @@ import datetime
 import numpy as np
 import copy
 import os
+import hashlib
+import itertools
+import pickle
+import re
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+_WHITESPACE = ' \t\n\r'
+# what may still follow a number cut at the end of the buffer, as in '3.' or '1e-'
+_NUMBER_TAIL = re.compile(r'[.eE+-]*\Z')
+
+class _JsonStream:
+    """
+    Incremental reader of a json document, decoding one value at a time.
+    """
+    def __init__(self, file, chunk_size=1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        """
+        Skip the whitespaces, return the next character or '' at the end of the file.
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return ''
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError('expecting %r at %r' % (character, self.buffer[self.position:self.position + 32]))
+        self.position += 1
+
+    def value(self):
+        """
+        Decode the next value, reading more of the file until the value is complete.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            # a number cut at the end of the buffer decodes too ('3.|14' as 3,
+            # '12|3' as 12), so it is only complete once the buffer holds the
+            # character that ends it
+            if isinstance(value, (int, float)) and not isinstance(value, bool) \
+                    and _NUMBER_TAIL.match(self.buffer, end) and self.fill():
+                continue
+            self.position = end
+            return value
+
+def iterJson(file, sections=('anns', 'imgs', 'imgToAnns'), chunk_size=1 << 20):
+    """
+    Incrementally parse a json object.
+    :param file (file)            : text file of the json object
+    :param sections (str array)   : keys of the object values whose entries are yielded one at a time
+    :return: (key, entry, value)  : the entries of the sections, entry is None for the other values
+    """
+    stream = _JsonStream(file, chunk_size)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key in sections and stream.peek() == '{':
+            stream.expect('{')
+            if stream.peek() == '}':
+                stream.expect('}')
+            else:
+                while True:
+                    entry = stream.value()
+                    stream.expect(':')
+                    yield key, entry, stream.value()
+                    if stream.peek() != ',':
+                        stream.expect('}')
+                        break
+                    stream.expect(',')
+        else:
+            yield key, None, stream.value()
+        if stream.peek() != ',':
+            stream.expect('}')
+            return
+        stream.expect(',')
+
+_MISSING = object()
+
+class ColumnarAnns(Mapping):
+    """
+    Column store of the anns, read as a dict of ann id -> ann dict.
+    The anns are sorted by id, numbers and lists of numbers are numpy columns,
+    the categorical attributes are small integer codes, the other strings are
+    stored in a utf-8 buffer indexed by offsets. The ann dicts are built on
+    access, so changing them does not change the store.
+    """
+    CATEGORICAL = ('class', 'legibility', 'language')
+
+    def __init__(self, anns):
+        """
+        :param anns (dict): ann id -> ann dict
+        """
+        self.ids = np.array(sorted(anns), dtype=np.int64)
+        records = [anns[annid] for annid in self.ids.tolist()]
+        keys = []
+        for record in records:
+            for key in record:
+                if key not in keys:
+                    keys.append(key)
+        self.columns = {key: self.buildColumn(key, [record.get(key, _MISSING) for record in records])
+                        for key in keys}
+
+    @classmethod
+    def buildColumn(cls, key, values):
+        """
+        :return: column (tuple)  : (kind, present mask or None, data...)
+        """
+        present = np.array([value is not _MISSING for value in values], dtype=bool)
+        items = [value for value in values if value is not _MISSING]
+        if present.all():
+            present = None
+
+        def isNumber(value):
+            return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+        def fill(default):
+            return [default if value is _MISSING else value for value in values]
+
+        if items and all(isinstance(value, str) for value in items):
+            if key in cls.CATEGORICAL:
+                categories = sorted(set(items))
+                codes = {category: code for code, category in enumerate(categories)}
+                return ('category', present, np.array([codes.get(value, 0) for value in fill('')], dtype=np.int16),
+                        categories)
+            encoded = [value.encode('utf-8') for value in fill('')]
+            return ('string', present, b''.join(encoded), np.cumsum([0] + [len(value) for value in encoded]))
+        if items and all(isNumber(value) for value in items):
+            dtype = np.int64 if all(isinstance(value, int) for value in items) else np.float64
+            return ('number', present, np.array(fill(0), dtype=dtype))
+        if items and all(isinstance(value, list) and all(isNumber(item) for item in value) for value in items):
+            lists = fill([])
+            flat = [item for value in lists for item in value]
+            dtype = np.int64 if all(isinstance(item, int) for item in flat) else np.float64
+            return ('list', present, np.array(flat, dtype=dtype), np.cumsum([0] + [len(value) for value in lists]))
+        return ('object', present, {row: value for row, value in enumerate(values) if value is not _MISSING})
+
+    def row(self, annid):
+        row = int(np.searchsorted(self.ids, annid))
+        if row >= len(self.ids) or self.ids[row] != annid:
+            raise KeyError(annid)
+        return row
+
+    def value(self, key, row):
+        column = self.columns[key]
+        kind, present = column[0], column[1]
+        if present is not None and not present[row]:
+            return _MISSING
+        if kind == 'category':
+            return column[3][column[2][row]]
+        if kind == 'string':
+            return column[2][column[3][row]:column[3][row + 1]].decode('utf-8')
+        if kind == 'number':
+            return column[2][row].item()
+        if kind == 'list':
+            return column[2][column[3][row]:column[3][row + 1]].tolist()
+        return column[2].get(row, _MISSING)
+
+    def __getitem__(self, annid):
+        row = self.row(annid)
+        ann = {}
+        for key in self.columns:
+            value = self.value(key, row)
+            if value is not _MISSING:
+                ann[key] = value
+        return ann
+
+    def __contains__(self, annid):
+        try:
+            self.row(annid)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, key):
+        """
+        Vectorized access to a column.
+        :param key (str)            : ann attribute
+        :return: (ids, values)      : integer array of the ids of the anns having the attribute and
+                                      the array of the values, None if the column is not numeric or categorical
+        """
+        if key not in self.columns:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        column = self.columns[key]
+        kind, present = column[0], column[1]
+        if kind == 'category':
+            values = np.array(column[3], dtype=object)[column[2]]
+        elif kind == 'number':
+            values = column[2]
+        else:
+            return None
+        if present is None:
+            return self.ids, values
+        return self.ids[present], values[present]
+
+    def invertedIndex(self, key):
+        """
+        :return: index (dict)   : value -> sorted integer array of ann ids, None if the column is not indexable
+        """
+        if key not in self.columns:
+            return {}
+        column = self.columns[key]
+        kind, present = column[0], column[1]
+        if kind == 'category':
+            codes, ids = column[2], self.ids
+            if present is not None:
+                codes, ids = codes[present], ids[present]
+            return {category: ids[codes == code] for code, category in enumerate(column[3])}
+        if kind == 'number':
+            ids, values = self.column(key)
+            order = np.argsort(values, kind='stable')
+            uniques, starts = np.unique(values[order], return_index=True)
+            return dict(zip(uniques.tolist(), np.split(ids[order], starts[1:])))
+        return None
 
 class COCO_Text:
-    def __init__(self, annotation_file=None):
+    def __init__(self, annotation_file=None, cache_dir=None, invalidate_cache=False, stream=False, columnar=False):
         """
         Constructor of COCO-Text helper class for reading and visualizing annotations.
         :param annotation_file (str): location of annotation file
+        :param cache_dir (str): directory of the binary cache of the parsed annotations and indexes
+        :param invalidate_cache (bool): rebuild the cache even if it is up to date
+        :param stream (bool): parse the annotation file incrementally, see streamImages
+        :param columnar (bool): keep the anns in a ColumnarAnns
         :return:
         """
         # load dataset
@@ -65,14 +316,34 @@ class COCO_Text:
         self.val = []
         self.test = []
         self.train = []
+        # inverted indexes of the ann attributes, built on first use
+        self.attrIndex = {}
+        self.areaIndex = None
         if not annotation_file == None:
             assert os.path.isfile(annotation_file), "file does not exist"
+            cache_file = None
+            if cache_dir:
+                cache_file = os.path.join(cache_dir, self.cacheKey(annotation_file) + '.pickle')
+                if not invalidate_cache and self.loadCache(cache_file):
+                    if columnar:
+                        self.columnarize()
+                    return
             print('loading annotations into memory...')
             time_t = datetime.datetime.utcnow()
-            dataset = json.load(open(annotation_file, 'r'))
-            print(datetime.datetime.utcnow() - time_t)
-            self.dataset = dataset
-            self.createIndex()
+            if stream:
+                for _ in self.streamImages(annotation_file):
+                    pass
+                print(datetime.datetime.utcnow() - time_t)
+            else:
+                dataset = json.load(open(annotation_file, 'r'))
+                print(datetime.datetime.utcnow() - time_t)
+                self.dataset = dataset
+                self.createIndex()
+            # the cache holds the plain ann dicts whatever columnar is
+            if cache_file:
+                self.saveCache(cache_file)
+            if columnar:
+                self.columnarize()
 
     def createIndex(self):
         # create index
@@ -84,8 +355,172 @@ class COCO_Text:
         self.val       = [int(cocoid) for cocoid in self.dataset['imgs'] if self.dataset['imgs'][cocoid]['set'] == 'val']
         self.test      = [int(cocoid) for cocoid in self.dataset['imgs'] if self.dataset['imgs'][cocoid]['set'] == 'test']
         self.train     = [int(cocoid) for cocoid in self.dataset['imgs'] if self.dataset['imgs'][cocoid]['set'] == 'train']
+        self.resetFilterIndex()
         print('index created!')
 
+    def columnarize(self):
+        """
+        Replace the ann dicts by a ColumnarAnns.
+        """
+        if isinstance(self.anns, ColumnarAnns):
+            return
+        self.anns = ColumnarAnns(self.anns)
+        self.dataset['anns'] = self.anns
+        self.resetFilterIndex()
+
+    def resetFilterIndex(self):
+        """
+        Drop the inverted indexes of getAnnByCat and getAnnIds, to be called when anns change.
+        """
+        self.attrIndex = {}
+        self.areaIndex = None
+
+    def attributeIndex(self, attribute):
+        """
+        Inverted index of an ann attribute.
+        :param attribute (str)  : ann attribute, e.g. 'legibility'
+        :return: index (dict)   : attribute value -> sorted integer array of ann ids,
+                                  None if the values are not hashable
+        """
+        if attribute not in self.attrIndex and isinstance(self.anns, ColumnarAnns):
+            self.attrIndex[attribute] = self.anns.invertedIndex(attribute)
+        if attribute not in self.attrIndex:
+            index = {}
+            try:
+                for annid, ann in self.anns.items():
+                    if attribute in ann:
+                        index.setdefault(ann[attribute], []).append(annid)
+                index = {value: np.sort(np.array(ids, dtype=np.int64)) for value, ids in index.items()}
+            except TypeError:
+                index = None
+            self.attrIndex[attribute] = index
+        return self.attrIndex[attribute]
+
+    def areaRange(self, areaRng):
+        """
+        Get ann ids with area strictly inside areaRng by binary search on the sorted areas.
+        :return: ids (int array)       : integer array of ann ids
+        """
+        if self.areaIndex is None:
+            if isinstance(self.anns, ColumnarAnns):
+                annids, areas = self.anns.column('area')
+                areas = areas.astype(np.float64)
+            else:
+                annids = np.array(list(self.anns.keys()), dtype=np.int64)
+                areas = np.array([self.anns[annid]['area'] for annid in annids.tolist()], dtype=np.float64)
+            order = np.argsort(areas, kind='stable')
+            self.areaIndex = (areas[order], annids[order])
+        areas, annids = self.areaIndex
+        start = np.searchsorted(areas, areaRng[0], side='right')
+        stop = np.searchsorted(areas, areaRng[1], side='left')
+        return annids[start:stop]
+
+    def streamImages(self, annotation_file, release=False):
+        """
+        Incrementally load the annotation file and build the indexes as it goes.
+        :param annotation_file (str): location of annotation file
+        :param release (bool)       : remove an image and its anns from the indexes once yielded
+        :return: (img, anns)        : every image with its anns, as soon as both are loaded
+        """
+        self.dataset.update(anns=self.anns, imgs=self.imgs, imgToAnns=self.imgToAnns)
+        splits = {'val': self.val, 'test': self.test, 'train': self.train}
+        # ids of the anns of an image which are not loaded yet
+        missing = {}
+
+        def ready(cocoid):
+            return cocoid in self.imgs and cocoid in missing and not missing[cocoid]
+
+        def emit(cocoid):
+            del missing[cocoid]
+            img = self.imgs[cocoid]
+            anns = [self.anns[annid] for annid in self.imgToAnns[cocoid]]
+            if release:
+                for annid in self.imgToAnns[cocoid]:
+                    del self.anns[annid]
+                del self.imgToAnns[cocoid]
+                del self.imgs[cocoid]
+            return img, anns
+
+        with open(annotation_file, 'r') as file:
+            for section, key, value in iterJson(file):
+                if section == 'anns':
+                    annid = int(key)
+                    self.anns[annid] = value
+                    cocoid = int(value['image_id'])
+                    if cocoid in missing:
+                        missing[cocoid].discard(annid)
+                elif section == 'imgs':
+                    cocoid = int(key)
+                    self.imgs[cocoid] = value
+                    if value.get('set') in splits:
+                        splits[value['set']].append(cocoid)
+                elif section == 'imgToAnns':
+                    cocoid = int(key)
+                    self.imgToAnns[cocoid] = value
+                    missing[cocoid] = set(annid for annid in value if annid not in self.anns)
+                else:
+                    self.dataset[section] = value
+                    if section == 'cats':
+                        self.cats = value
+                    continue
+                if ready(cocoid):
+                    yield emit(cocoid)
+        self.resetFilterIndex()
+
+    CACHE_ATTRIBUTES = ('dataset', 'anns', 'imgToAnns', 'imgs', 'cats', 'val', 'test', 'train')
+
+    @staticmethod
+    def cacheKey(annotation_file, chunk_size=1 << 20):
+        """
+        Fingerprint of the annotation file from its path, size, mtime and content hash.
+        :param annotation_file (str): location of annotation file
+        :return: key (str)           : hex digest naming the cache file
+        """
+        stat = os.stat(annotation_file)
+        content = hashlib.sha1()
+        with open(annotation_file, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                content.update(chunk)
+        fingerprint = '{}:{}:{}:{}'.format(os.path.abspath(annotation_file), stat.st_size,
+                                           stat.st_mtime_ns, content.hexdigest())
+        return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+
+    def loadCache(self, cache_file):
+        """
+        Load the dataset and indexes from the cache file.
+        :return: loaded (bool)
+        """
+        if not os.path.isfile(cache_file):
+            return False
+        print('loading annotations from cache %s...' % cache_file)
+        time_t = datetime.datetime.utcnow()
+        try:
+            with open(cache_file, 'rb') as file:
+                cache = pickle.load(file)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as error:
+            print('ignoring invalid cache: %s' % error)
+            return False
+        if not isinstance(cache['anns'], dict):
+            print('ignoring cache of columnar anns')
+            return False
+        for name in self.CACHE_ATTRIBUTES:
+            setattr(self, name, cache[name])
+        print(datetime.datetime.utcnow() - time_t)
+        return True
+
+    def saveCache(self, cache_file):
+        """
+        Save the dataset and indexes to the cache file, the objects shared by them are stored once.
+        """
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        temporary_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(temporary_file, 'wb') as file:
+            pickle.dump({name: getattr(self, name) for name in self.CACHE_ATTRIBUTES}, file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file, cache_file)
+
     def info(self):
         """
         Print information about the annotation file.
@@ -104,7 +539,19 @@ class COCO_Text:
             : get anns for given categories - anns have to satisfy all given property tuples
         :return: ids (int array)       : integer array of ann ids
         """
-        return self.filtering(self.anns, [lambda d, x=a, y=b:d[x] == y for (a,b) in properties])
+        ids = None
+        for attribute, value in properties:
+            index = self.attributeIndex(attribute)
+            if index is None:
+                matched = np.array(self.filtering(self.anns, [lambda d, x=attribute, y=value:d[x] == y]),
+                                   dtype=np.int64)
+                matched.sort()
+            else:
+                matched = index.get(value, np.zeros(0, dtype=np.int64))
+            ids = matched if ids is None else np.intersect1d(ids, matched, assume_unique=True)
+        if ids is None:
+            return list(self.anns.keys())
+        return ids.tolist()
 
     def getAnnIds(self, imgIds=[], catIds=[], areaRng=[]):
         """
@@ -122,11 +569,13 @@ class COCO_Text:
             anns = list(self.anns.keys())
         else:
             if not len(imgIds) == 0:
-                anns = sum([self.imgToAnns[imgId] for imgId in imgIds if imgId in self.imgToAnns],[])
+                anns = list(itertools.chain.from_iterable(self.imgToAnns[imgId] for imgId in imgIds if imgId in self.imgToAnns))
             else:
                 anns = list(self.anns.keys())
-            anns = anns if len(catIds)  == 0 else list(set(anns).intersection(set(self.getAnnByCat(catIds))))
-            anns = anns if len(areaRng) == 0 else [ann for ann in anns if self.anns[ann]['area'] > areaRng[0] and self.anns[ann]['area'] < areaRng[1]]
+            anns = anns if len(catIds)  == 0 else list(set(anns).intersection(self.getAnnByCat(catIds)))
+            if len(areaRng) > 0:
+                anns = np.array(anns, dtype=np.int64)
+                anns = anns[np.isin(anns, self.areaRange(areaRng))].tolist()
         return anns
 
     def getImgIds(self, imgIds=[], catIds=[]):
@@ -203,10 +652,40 @@ class COCO_Text:
         p = PatchCollection(boxes, facecolors=color, edgecolors=(0,0,0,1), linewidths=3, alpha=0.4)
         ax.add_collection(p)
 
+    RESULT_FIELDS = ('image_id', 'x', 'y', 'w', 'h', 'score', 'utf8_string')
+
+    @classmethod
+    def resultAnns(cls, results):
+        """
+        Result dicts of results given as a numpy array.
+        :param results (array): structured array with the RESULT_FIELDS (score and utf8_string optional),
+                                or rows of (image_id, x, y, w, h, score[, text])
+        :return: anns (list)     : dicts with 'image_id', 'bbox', and 'score' and 'utf8_string' if present
+        """
+        if results.dtype.names is not None:
+            fields = [results[name] if name in results.dtype.names else None for name in cls.RESULT_FIELDS]
+        else:
+            assert results.ndim == 2 and results.shape[1] in (6, 7), 'results have incorrect format'
+            fields = [results[:, index] for index in range(results.shape[1])] + [None] * (7 - results.shape[1])
+        imageIds, x, y, w, h, score, text = fields
+        bboxes = np.stack([x, y, w, h], axis=1).astype(np.float64).tolist()
+        scores = score.astype(np.float64).tolist() if score is not None else [None] * len(bboxes)
+        texts = text.tolist() if text is not None else [None] * len(bboxes)
+        anns = []
+        for imageId, bbox, score, text in zip(imageIds.astype(np.int64).tolist(), bboxes, scores, texts):
+            ann = {'image_id': imageId, 'bbox': bbox}
+            if score is not None:
+                ann['score'] = score
+            if text is not None:
+                ann['utf8_string'] = str(text)
+            anns.append(ann)
+        return anns
+
     def loadRes(self, resFile):
         """
         Load result file and return a result api object.
-        :param   resFile (str)     : file name of result file
+        The result dicts are copied, not modified.
+        :param   resFile (str)     : file name of result file, list of result dicts, or numpy array (see resultAnns)
         :return: res (obj)         : result api object
         """
         res = COCO_Text()
@@ -218,26 +697,27 @@ class COCO_Text:
             anns = json.load(open(resFile))
         else:
             anns = resFile
+        if isinstance(anns, np.ndarray):
+            anns = self.resultAnns(anns)
         assert type(anns) == list, 'results in not an array of objects'
-        annsImgIds = [int(ann['image_id']) for ann in anns]
+        assert anns[0]['bbox'] != [], 'results have incorrect format'
+        imageIds = np.array([int(ann['image_id']) for ann in anns], dtype=np.int64)
 
-        if set(annsImgIds) != (set(annsImgIds) & set(self.getImgIds())):
+        valid = np.isin(imageIds, np.array(list(self.imgs.keys()), dtype=np.int64))
+        if not valid.all():
             print('Results do not correspond to current coco set')
-            print('skipping ', str(len(set(annsImgIds)) - len(set(annsImgIds) & set(self.getImgIds()))), ' images')
-        annsImgIds = list(set(annsImgIds) & set(self.getImgIds()))
-
-        res.imgToAnns = {cocoid : [] for cocoid in annsImgIds}
-        res.imgs = {cocoid: self.imgs[cocoid] for cocoid in annsImgIds}
+            print('skipping ', str(len(np.unique(imageIds)) - len(np.unique(imageIds[valid]))), ' images')
+        ids = np.flatnonzero(valid)
+        # shallow copies, the evaluation reads the plain dicts faster than a ColumnarAnns
+        res.anns = {id: dict(anns[id], area=anns[id]['bbox'][2] * anns[id]['bbox'][3], id=id) for id in ids.tolist()}
+        res.dataset['anns'] = res.anns
 
-        assert anns[0]['bbox'] != [], 'results have incorrect format'
-        for id, ann in enumerate(anns):
-            if ann['image_id'] not in annsImgIds:
-                continue
-            bb = ann['bbox']
-            ann['area'] = bb[2]*bb[3]
-            ann['id'] = id
-            res.anns[id] = ann
-            res.imgToAnns[ann['image_id']].append(id)
+        imageIds = imageIds[ids]
+        order = np.argsort(imageIds, kind='stable')
+        cocoids, starts = np.unique(imageIds[order], return_index=True)
+        res.imgToAnns = {cocoid: annids for cocoid, annids in
+                         zip(cocoids.tolist(), [item.tolist() for item in np.split(ids[order], starts[1:])])}
+        res.imgs = {cocoid: self.imgs[cocoid] for cocoid in res.imgToAnns}
         print('DONE (t=%0.2fs)'%((datetime.datetime.utcnow() - time_t).total_seconds()))
 
         return res
@@ -12,6 +12,7 @@ requirements = [
     'PyYaml',
     "imgaug",
     "pyconfigmanager",
+    "crc32c",
 ]
 dependency_links = [
     """git+https://github.com/miacro/{}.git@master#egg={}-9999""".format(